@@ -0,0 +1,545 @@
+import errno
+import logging
+import socket
+import threading
+from os import fstat, strerror
+from mmap import PAGESIZE
+from struct import pack
+from time import time, sleep
+from ctypes import (
+    CDLL, Structure, POINTER, get_errno, sizeof, addressof, cast,
+    c_int, c_uint, c_uint32, c_size_t, c_void_p
+    )
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from numpy import uint8, int64, ndarray, empty, copyto, flatnonzero, arange, maximum, concatenate
+from numpy.ctypeslib import as_array
+
+# the R2DBE sends every VDIF frame behind an 8-byte packet serial number
+PSN_SIZE = 8
+FRAME_SIZE = 8224
+PACKET_SIZE = PSN_SIZE + FRAME_SIZE
+
+# byte offset of the PSN within a VDIF frame (EDV words 6-7)
+HEADER_PSN_OFFSET = 24
+
+# PSNs behind the highest seen that a late packet may still fill in;
+# anything further behind is a stray duplicate or a sender restart
+REORDER_WINDOW = 8192
+
+# packets in a row further behind than that which make a restart
+RESYNC_PACKETS = 16
+
+# packets per chunk, the unit handed from receiver to writer
+PACKETS_PER_CHUNK = 1024
+
+# default ring size per interface, about a second at 4 Gbps
+RING_BYTES = 512 * 2**20
+
+# default socket receive buffer (the kernel caps it at net.core.rmem_max)
+RCVBUF_BYTES = 64 * 2**20
+
+# default packets pulled per recvmmsg call (1 means recv_into)
+RECV_BATCH = 64
+
+# how often a blocked receiver checks whether it should stop
+RECV_TIMEOUT = 0.2
+
+# recvmmsg flag: block for the first packet only (Linux, missing from socket)
+MSG_WAITFORONE = 0x10000
+
+# seconds between rate reports
+REPORT_SECS = 1.0
+
+logger = logging.getLogger('capture')
+
+
+class IOVec(Structure):
+    _fields_ = [('iov_base', c_void_p), ('iov_len', c_size_t)]
+
+
+class MsgHdr(Structure):
+    _fields_ = [
+        ('msg_name', c_void_p),
+        ('msg_namelen', c_uint32),
+        ('msg_iov', POINTER(IOVec)),
+        ('msg_iovlen', c_size_t),
+        ('msg_control', c_void_p),
+        ('msg_controllen', c_size_t),
+        ('msg_flags', c_int),
+        ]
+
+
+class MMsgHdr(Structure):
+    _fields_ = [('msg_hdr', MsgHdr), ('msg_len', c_uint)]
+
+
+def _load_recvmmsg():
+    """ Return libc's recvmmsg through ctypes, or None where there is none (it is Linux-only) """
+    try:
+        recvmmsg = CDLL(None, use_errno=True).recvmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [c_int, c_void_p, c_uint, c_int, c_void_p]
+    recvmmsg.restype = c_int
+    return recvmmsg
+
+recvmmsg = _load_recvmmsg()
+
+
+def _words(array_, n_items, item_size):
+    """ Return a (n_items, words) numpy view of a ctypes array, in pointer-sized words """
+    word = sizeof(c_size_t)
+    return as_array(cast(array_, POINTER(c_size_t)), shape=(n_items, item_size // word))
+
+
+def packet_messages(slots):
+    """ Return an mmsghdr array with one message per row of a 2-D uint8 array
+
+    Each message has a single iovec covering its row, so recvmmsg puts
+    every datagram straight into its slot. The structures are filled in
+    as arrays of pointer-sized words, since a ring has tens of
+    thousands of them.
+    """
+
+    n_slots, slot_size = slots.shape
+    word = sizeof(c_size_t)
+    iovecs = (IOVec * n_slots)()
+    messages = (MMsgHdr * n_slots)()
+
+    iovec_words = _words(iovecs, n_slots, sizeof(IOVec))
+    iovec_words[:, IOVec.iov_base.offset // word] = slots.ctypes.data + arange(n_slots) * slots.strides[0]
+    iovec_words[:, IOVec.iov_len.offset // word] = slot_size
+
+    message_words = _words(messages, n_slots, sizeof(MMsgHdr))
+    message_words[:, MsgHdr.msg_iov.offset // word] = addressof(iovecs) + arange(n_slots) * sizeof(IOVec)
+    message_words[:, MsgHdr.msg_iovlen.offset // word] = 1
+
+    # the iovecs must live as long as the messages
+    messages.iovecs = iovecs
+    return messages
+
+
+def message_lengths(messages):
+    """ Return a numpy view of the msg_len fields of an mmsghdr array """
+    words = as_array(cast(messages, POINTER(c_uint32)), shape=(len(messages), sizeof(MMsgHdr) // 4))
+    return words[:, MMsgHdr.msg_len.offset // 4]
+
+
+def page_aligned(n_bytes):
+    """ Return a uint8 array of n_bytes starting on a page boundary """
+    raw = empty(n_bytes + PAGESIZE, uint8)
+    start = -raw.ctypes.data % PAGESIZE
+    return raw[start:start + n_bytes]
+
+
+def kernel_drops(sock):
+    """ Return the datagrams the kernel dropped on a UDP socket, or None if unknown (Linux only) """
+
+    inode = fstat(sock.fileno()).st_ino
+    try:
+        with open('/proc/net/udp') as udp:
+            lines = udp.readlines()[1:]
+    except IOError:
+        return None
+
+    # the inode is the tenth field and drops the last
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 9 and int(fields[9]) == inode:
+            return int(fields[-1])
+    return None
+
+
+class PSNTracker(object):
+    """ Online loss, reorder and duplicate accounting from packet serial numbers
+
+    A PSN past the highest seen so far opens a gap, counted as `lost`
+    until a late packet fills it in and is counted as `reordered`
+    instead. A PSN at or behind the highest that fills no gap is one of
+    the `duplicates`. At least RESYNC_PACKETS packets in a row more than
+    `window` behind are taken as a sender restart: tracking starts over
+    from the first of them, which counts one of the `resyncs`.
+    """
+
+    def __init__(self, window=REORDER_WINDOW):
+        self.window = window
+        self.highest = None
+        self.missing = set()
+        self.packets = self.lost = self.reordered = self.duplicates = self.resyncs = 0
+
+    def update(self, psns):
+        """ Account for an array of PSNs in arrival order """
+
+        if not len(psns):
+            return
+        psns = psns.astype(int64)
+        if self.highest is None:
+            self.highest = int(psns[0]) - 1
+
+        # the highest PSN before each packet
+        running = maximum.accumulate(concatenate(([self.highest], psns)))
+        before = running[:-1]
+
+        # packets far behind up to the end are a sender restart, fewer are strays
+        stale = psns < before - self.window
+        n_psns = len(psns)
+        if stale[-1]:
+            fresh = flatnonzero(~stale)
+            restart = fresh[-1] + 1 if len(fresh) else 0
+            if n_psns - restart >= RESYNC_PACKETS:
+                n_psns = restart
+
+        self._count(psns[:n_psns], before[:n_psns])
+        self.highest = int(running[n_psns])
+        if n_psns < len(psns):
+            logger.warning('PSN went back from {0} to {1}, restarting loss tracking'.format(
+                self.highest, psns[n_psns]))
+            self.highest = None
+            self.missing.clear()
+            self.resyncs += 1
+            self.update(psns[n_psns:])
+
+    def _count(self, psns, before):
+        """ Count PSNs none of which is more than the window behind the one before it """
+
+        if not len(psns):
+            return
+        self.packets += len(psns)
+
+        # new gaps, of which only the last `window` PSNs can still be filled in
+        ahead = psns > before
+        gapped = flatnonzero(ahead & (psns > before + 1))
+        for n in gapped:
+            self.lost += int(psns[n] - before[n] - 1)
+            self.missing.update(range(max(int(before[n]) + 1, int(psns[n]) - self.window), int(psns[n])))
+
+        # late packets fill gaps in, anything else behind is a duplicate
+        for psn in psns[~ahead]:
+            psn = int(psn)
+            if psn in self.missing:
+                self.missing.remove(psn)
+                self.reordered += 1
+                self.lost -= 1
+            else:
+                self.duplicates += 1
+
+        # forget gaps too old to be filled in
+        if len(self.missing) > 2 * self.window:
+            oldest = int(max(psns[-1], before[-1])) - self.window
+            self.missing = set(psn for psn in self.missing if psn >= oldest)
+
+
+class PacketRing(object):
+    """ Page-aligned ring of chunks of packet slots
+
+    Chunk numbers cycle through `free` to a receiver, which fills their
+    slots, and on to the writer, which hands them back
+    once their frames are copied out.
+    """
+
+    def __init__(self, ring_bytes=RING_BYTES, packet_size=PACKET_SIZE, packets_per_chunk=PACKETS_PER_CHUNK):
+        n_chunks = max(2, ring_bytes // (packet_size * packets_per_chunk))
+        self.packet_size = packet_size
+        self.packets_per_chunk = packets_per_chunk
+        self.slots = page_aligned(n_chunks * packets_per_chunk * packet_size).reshape(
+            n_chunks, packets_per_chunk, packet_size)
+        self.free = Queue()
+        for chunk_n in range(n_chunks):
+            self.free.put(chunk_n)
+        self._messages = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def messages(self):
+        """ Return the recvmmsg messages of every slot, in ring order (built on first call) """
+        if self._messages is None:
+            self._messages = packet_messages(self.slots.reshape(-1, self.packet_size))
+        return self._messages
+
+
+class UDPReceiver(threading.Thread):
+    """ Thread receiving the packets of one interface into its own ring
+
+    Counts `packets` and `bytes` kept, `overruns` (packets thrown away
+    because the writer had no free chunk to give back) and `short`
+    packets of the wrong size, which are not kept either. The PSNs of
+    each chunk go through `tracker` as the chunk is passed on, so every
+    packet lost on the way, in the kernel or here, shows as PSN loss.
+
+    With batch > 1 and recvmmsg available, up to `batch` packets are
+    pulled per system call straight into the ring's slots; otherwise
+    every packet takes one recv_into.
+    """
+
+    def __init__(self, address, ring, writer, file_, n_packets=None, rcvbuf=RCVBUF_BYTES, batch=RECV_BATCH,
+                 psn_offset=PSN_SIZE + HEADER_PSN_OFFSET):
+        super(UDPReceiver, self).__init__(name='recv {0}:{1}'.format(*address))
+        self.daemon = True
+        self.address = address
+        self.ring = ring
+        self.writer = writer
+        self.file_ = file_
+        self.n_packets = n_packets
+        self.packets = self.bytes = self.overruns = self.short = self.calls = 0
+        self.final_kernel_drops = None
+        self.psn_offset = psn_offset
+        self.tracker = PSNTracker()
+        self.batch = batch if recvmmsg is not None else 1
+        if batch > 1 and recvmmsg is None:
+            logger.warning('recvmmsg is not available here, receiving one packet per call')
+        self._stop_event = threading.Event()
+        self._chunk_n, self._slot = None, 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        actual = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if actual < rcvbuf:
+            logger.warning('{0}: asked for a {1} byte receive buffer, got {2} (raise net.core.rmem_max)'.format(
+                self.name, rcvbuf, actual))
+        self.sock.bind(address)
+
+        # recvmmsg needs a blocking socket, which the kernel times out instead,
+        # and the ring's messages, which are best built before packets arrive
+        if self.batch > 1:
+            ring.messages()
+            seconds = int(RECV_TIMEOUT)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                                 pack('ll', seconds, int(1e6 * (RECV_TIMEOUT - seconds))))
+        else:
+            self.sock.settimeout(RECV_TIMEOUT)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def kernel_drops(self):
+        return self.final_kernel_drops if self.final_kernel_drops is not None else kernel_drops(self.sock)
+
+    def _wanted(self):
+        """ Return how many more packets to take """
+        if self._stop_event.is_set():
+            return 0
+        return self.n_packets - self.packets if self.n_packets is not None else self.ring.packets_per_chunk
+
+    def _next_chunk(self):
+        """ Take a fresh chunk if there is none, returning False while the writer has none free """
+        if self._chunk_n is None:
+            try:
+                self._chunk_n = self.ring.free.get_nowait()
+            except Empty:
+                return False
+        return True
+
+    def _kept(self, n_packets):
+        """ Account for n_packets packets put in the current chunk, passing it on once full """
+        self.packets += n_packets
+        self.bytes += n_packets * self.ring.packet_size
+        self._slot += n_packets
+        if self._slot == self.ring.packets_per_chunk:
+            self._pass_on()
+
+    def _pass_on(self):
+        """ Track the PSNs of the current chunk and hand it to the writer """
+        psns = ndarray((self._slot,), '<u8', buffer=self.ring.slots[self._chunk_n], offset=self.psn_offset,
+                       strides=(self.ring.packet_size,))
+        self.tracker.update(psns)
+        self.writer.put(self, self._chunk_n, self._slot)
+        self._chunk_n, self._slot = None, 0
+
+    def _receive_packets(self):
+        """ Receive one packet per system call """
+
+        packet_size = self.ring.packet_size
+        scratch = empty(packet_size, uint8)
+        while self._wanted() > 0:
+
+            # drain into scratch while the writer catches up
+            have_chunk = self._next_chunk()
+            target = self.ring.slots[self._chunk_n, self._slot] if have_chunk else scratch
+            try:
+                n_bytes = self.sock.recv_into(target, packet_size)
+            except socket.timeout:
+                continue
+            self.calls += 1
+            if n_bytes != packet_size:
+                self.short += 1
+            elif not have_chunk:
+                self.overruns += 1
+            else:
+                self._kept(1)
+
+    def _receive_batches(self):
+        """ Receive up to `batch` packets per recvmmsg call, straight into the ring """
+
+        packet_size = self.ring.packet_size
+        packets_per_chunk = self.ring.packets_per_chunk
+        messages = self.ring.messages()
+        lengths = message_lengths(messages)
+        scratch = empty((self.batch, packet_size), uint8)
+        scratch_messages = packet_messages(scratch)
+        fd = self.sock.fileno()
+        while True:
+            wanted = self._wanted()
+            if wanted <= 0:
+                break
+
+            # fill the rest of the chunk, or drain into scratch while the writer catches up
+            have_chunk = self._next_chunk()
+            if have_chunk:
+                first = self._chunk_n * packets_per_chunk + self._slot
+                count = min(self.batch, packets_per_chunk - self._slot, wanted)
+                address = addressof(messages) + first * sizeof(MMsgHdr)
+            else:
+                count = self.batch
+                address = addressof(scratch_messages)
+
+            # wait for one packet, then take whatever else is queued
+            n_received = recvmmsg(fd, address, count, MSG_WAITFORONE, None)
+            if n_received < 0:
+                error = get_errno()
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    continue
+                raise socket.error(error, strerror(error))
+            self.calls += 1
+
+            if not have_chunk:
+                self.overruns += n_received
+                continue
+
+            # keep only whole packets, moving any after a short one down
+            received = lengths[first:first + n_received]
+            if (received != packet_size).any():
+                whole = flatnonzero(received == packet_size)
+                self.short += n_received - len(whole)
+                slots = self.ring.slots[self._chunk_n]
+                for n, slot in enumerate(whole):
+                    slots[self._slot + n] = slots[self._slot + slot]
+                n_received = len(whole)
+            self._kept(n_received)
+
+    def run(self):
+        try:
+            if self.batch > 1:
+                self._receive_batches()
+            else:
+                self._receive_packets()
+
+        finally:
+            # flush what is left of the last chunk
+            if self._chunk_n is not None:
+                if self._slot:
+                    self._pass_on()
+                else:
+                    self.ring.free.put(self._chunk_n)
+            self.final_kernel_drops = kernel_drops(self.sock)
+            self.sock.close()
+
+
+class ChunkWriter(threading.Thread):
+    """ Thread writing the frames of full chunks to their receiver's file
+
+    Each chunk is copied out without its packet prefixes into one
+    buffer, handed back to its ring, and written with a single call.
+    """
+
+    def __init__(self, packets_per_chunk=PACKETS_PER_CHUNK, frame_size=FRAME_SIZE, prefix_size=PSN_SIZE):
+        super(ChunkWriter, self).__init__(name='writer')
+        self.daemon = True
+        self.prefix_size = prefix_size
+        self.frames = page_aligned(packets_per_chunk * frame_size).reshape(packets_per_chunk, frame_size)
+        self.queue = Queue()
+        self.bytes = 0
+
+    def put(self, receiver, chunk_n, n_packets):
+        self.queue.put((receiver, chunk_n, n_packets))
+
+    def finish(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            receiver, chunk_n, n_packets = item
+            frames = self.frames[:n_packets]
+            copyto(frames, receiver.ring.slots[chunk_n, :n_packets, self.prefix_size:])
+            receiver.ring.free.put(chunk_n)
+            frames.tofile(receiver.file_)
+            self.bytes += frames.nbytes
+
+
+class Capture(object):
+    """ Capture VDIF packets from several interfaces to one file each
+
+    Every (host, port) address gets its own ring and receiver thread,
+    and a single writer thread flushes whole chunks to disk. Receivers
+    stop after n_packets packets each, if given, or when stopped.
+    """
+
+    def __init__(self, addresses, filenames, n_packets=None, rcvbuf=RCVBUF_BYTES, ring_bytes=RING_BYTES,
+                 packets_per_chunk=PACKETS_PER_CHUNK, frame_size=FRAME_SIZE, prefix_size=PSN_SIZE, batch=RECV_BATCH):
+        self.writer = ChunkWriter(packets_per_chunk, frame_size, prefix_size)
+        self.files = list(open(filename, 'wb') for filename in filenames)
+        self.receivers = []
+        for address, file_ in zip(addresses, self.files):
+            ring = PacketRing(ring_bytes, prefix_size + frame_size, packets_per_chunk)
+            self.receivers.append(UDPReceiver(address, ring, self.writer, file_, n_packets, rcvbuf, batch,
+                                              prefix_size + HEADER_PSN_OFFSET))
+            logger.debug('{0}: {1} chunks of {2} packets'.format(self.receivers[-1].name, len(ring), packets_per_chunk))
+
+    def start(self):
+        self.writer.start()
+        for receiver in self.receivers:
+            receiver.start()
+
+    def running(self):
+        return any(receiver.is_alive() for receiver in self.receivers)
+
+    def stop(self):
+        for receiver in self.receivers:
+            receiver.stop()
+
+    def join(self):
+        """ Wait for the receivers, then for the writer to flush everything """
+        for receiver in self.receivers:
+            receiver.join()
+        self.writer.finish()
+        self.writer.join()
+        for file_ in self.files:
+            file_.close()
+
+    def stats(self):
+        """ Return a dict of counters per receiver """
+        return list(
+            dict(name=receiver.name, packets=receiver.packets, bytes=receiver.bytes, overruns=receiver.overruns,
+                 short=receiver.short, calls=receiver.calls, kernel_drops=receiver.kernel_drops(),
+                 lost=receiver.tracker.lost, reordered=receiver.tracker.reordered,
+                 duplicates=receiver.tracker.duplicates, resyncs=receiver.tracker.resyncs)
+            for receiver in self.receivers
+            )
+
+    def monitor(self, interval=REPORT_SECS):
+        """ Log the capture rate, drops and PSN accounting of every receiver each interval until all are done """
+
+        last, last_time = self.stats(), time()
+        while self.running():
+            sleep(interval)
+            now, now_time = self.stats(), time()
+            elapsed = max(now_time - last_time, 1e-9)
+            for before, after in zip(last, now):
+                logger.info('{0}: {1:.3f} Gbps, {2} packets, {3} lost, {4} reordered, {5} duplicates, '
+                            '{6} overruns, {7} short, {8} kernel drops'.format(
+                                after['name'], 8e-9 * (after['bytes'] - before['bytes']) / elapsed,
+                                after['packets'] - before['packets'], after['lost'] - before['lost'],
+                                after['reordered'] - before['reordered'],
+                                after['duplicates'] - before['duplicates'], after['overruns'] - before['overruns'],
+                                after['short'] - before['short'],
+                                'unknown' if after['kernel_drops'] is None or before['kernel_drops'] is None
+                                else after['kernel_drops'] - before['kernel_drops']))
+            last, last_time = now, now_time
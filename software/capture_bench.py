@@ -0,0 +1,99 @@
+import logging
+import argparse
+import socket
+from struct import pack
+from os import times
+from time import time, sleep
+from multiprocessing import Process
+
+from capture import Capture, FRAME_SIZE, PSN_SIZE, PACKET_SIZE, HEADER_PSN_OFFSET, RECV_BATCH, RCVBUF_BYTES
+
+# seconds the receiver waits for late packets once the senders are done
+DRAIN_SECS = 0.5
+
+# packets a paced sender sends back to back
+SEND_BURST = 64
+
+def send_packets(port, n_packets, sender_n, n_senders, rate=0):
+    """ Send n_packets capture-sized datagrams to a local port, at `rate` per second if given
+
+    Senders interleave their PSNs, so together they send one stream.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    header = b'\0' * HEADER_PSN_OFFSET
+    payload = b'\0' * (FRAME_SIZE - HEADER_PSN_OFFSET - 8)
+    start = time()
+    for packet_n in range(n_packets):
+        psn = pack('<Q', packet_n * n_senders + sender_n)
+        sock.sendto(psn + header + psn + payload, ('127.0.0.1', port))
+
+        # keep to the schedule a burst at a time
+        if rate and packet_n % SEND_BURST == SEND_BURST - 1:
+            ahead = start + (packet_n + 1) / float(rate) - time()
+            if ahead > 0:
+                sleep(ahead)
+    sock.close()
+
+def main():
+    """ Benchmark the capture receive paths as asked on the command line """
+
+    # parse the user's command line arguments
+    parser = argparse.ArgumentParser(description='Benchmark the capture receive paths against local loopback senders')
+    parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
+    parser.add_argument('-n', '--packets', dest='packets', type=int, default=200000,
+                        help='packets sent by each sender (default: 200000)')
+    parser.add_argument('-s', '--senders', dest='senders', type=int, default=2,
+                        help='number of sender processes (default: 2)')
+    parser.add_argument('-r', '--rate', dest='rate', metavar='PPS', type=float, default=0,
+                        help='packets per second from each sender, 0 for as fast as possible (default: 0)')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=40123, help='loopback port (default: 40123)')
+    parser.add_argument('--batch', dest='batches', metavar='N', type=int, action='append', default=None,
+                        help='packets per receive call to try, repeat for more; 1 is recv_into (default: 1 and {0})'.format(
+                            RECV_BATCH))
+    parser.add_argument('--rcvbuf', dest='rcvbuf', metavar='MB', type=float, default=RCVBUF_BYTES / 2.0**20,
+                        help='socket receive buffer size (default: {0:.0f})'.format(RCVBUF_BYTES / 2.0**20))
+    args = parser.parse_args()
+
+    # set up some basic logging
+    logging.basicConfig(format='%(asctime)-15s - %(message)s')
+    logger = logging.getLogger('capture_bench')
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    logging.getLogger('capture').setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    sent = args.packets * args.senders
+    for batch in args.batches or (1, RECV_BATCH):
+
+        # capture to nowhere, so only the receive path is measured
+        capture = Capture([('127.0.0.1', args.port)], ['/dev/null'], sent, int(args.rcvbuf * 2**20),
+                          frame_size=FRAME_SIZE, prefix_size=PSN_SIZE, batch=batch)
+        capture.start()
+
+        senders = list(Process(target=send_packets, args=(args.port, args.packets, n, args.senders, args.rate)) for n in range(args.senders))
+        start_cpu = times()
+        start = time()
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        send_secs = time() - start
+
+        # give the receiver a moment for what is still queued
+        sleep(DRAIN_SECS)
+        capture.stop()
+        capture.join()
+        stats = capture.stats()[0]
+
+        # CPU spent in this process (receiver, writer and all), senders excluded
+        end_cpu = times()
+        cpu_secs = (end_cpu[0] - start_cpu[0]) + (end_cpu[1] - start_cpu[1])
+
+        logger.info('batch {0:3d}: sent {1} packets at {2:.0f}/s ({3:.2f} Gbps), received {4} ({5:.1f}%), '
+                    '{6} kernel drops, {7} overruns, {8} lost and {9} reordered by PSN, '
+                    '{10:.2f} us CPU and {11:.1f} calls per packet received'.format(
+                        batch, sent, sent / send_secs, 8e-9 * sent * PACKET_SIZE / send_secs, stats['packets'],
+                        100.0 * stats['packets'] / sent, stats['kernel_drops'], stats['overruns'], stats['lost'],
+                        stats['reordered'], 1e6 * cpu_secs / max(1, stats['packets']),
+                        float(stats['calls']) / max(1, stats['packets'])))
+
+if __name__ == '__main__':
+    main()
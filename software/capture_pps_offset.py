@@ -11,7 +11,7 @@ import logging
 
 from argparse import ArgumentParser
 from numpy import int32
-from vdif import VDIFFrame
+from vdif import VDIFFile
 
 VDIF_PKT_SIZE = 8224
 DEFAULT_LOG_FILE = '/var/log/r2dbe/pps-drift.log'
@@ -36,10 +36,9 @@ if not args.file:
 	logging.error(err_msg)
 	raise ValueError(err_msg)
 try:
-	with open(args.file[0],'r') as f_vdif:
-		b = f_vdif.read(VDIF_PKT_SIZE)
-		if (len(b) == VDIF_PKT_SIZE):
-			v = VDIFFrame.from_bin(b)
+	with VDIFFile(args.file[0],frame_size=VDIF_PKT_SIZE) as f_vdif:
+		if (len(f_vdif) > 0):
+			v = f_vdif.header(0)
 			log_str = '{0},{1},{2},{3}\r\n'.format(v.ref_epoch,v.secs_since_epoch,v.data_frame,int32(v.eud[1]))
 			try:
 				with open(args.logfile,'a') as f_log:
@@ -1,20 +1,65 @@
 import logging
 
-# generic class for checks
+from numpy import (
+    ndarray, array, asarray, ascontiguousarray, concatenate, zeros, sort,
+    unique, ones, diff, flatnonzero, searchsorted, maximum, bincount, sqrt, log2, dtype, uint8
+    )
+
+from vdif import state_counts, group_state_counts, IDEAL_2BIT_OCCUPANCY
+
+# header fields ContinuityCheck looks at
+CONTINUITY_FIELDS = ('secs_since_epoch', 'data_frame', 'thread_id', 'station_id', 'psn')
+CONTINUITY_DTYPE = dtype([
+    ('secs_since_epoch', '<u4'),
+    ('data_frame', '<u4'),
+    ('thread_id', '<u2'),
+    ('station_id', 'S2'),
+    ('psn', '<u8'),
+    ])
+
+# StateOccupancyCheck counts per run of frames when runs average this many
+MIN_RUN_FRAMES = 16
+
+# generic class for checks, called per frame with a header object or
+# per batch with a structured array of headers (see vdif.HEADER_DTYPE)
 class Check(object):
 
+    # checks that also look at the packed payloads set this
+    needs_payload = False
+
     def __init__(self, desc, attr):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.results = None
         self.desc = desc
         self.attr = attr
 
+        # header fields the check looks at
+        self.fields = (attr,)
+
     def __str__(self):
         return "{0:<40s}: {1}".format(self.desc, self.results)
 
+    def __getstate__(self):
+        # loggers do not pickle, so each process gets its own
+        state = self.__dict__.copy()
+        del state['logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
     def __call__(self, frame):
         pass
 
+    def merge(self, other, contiguous=True):
+        """ Fold in the results of this check run over the frames that follow
+
+        If not `contiguous`, the other frames are a separate sample and
+        nothing is checked across the boundary.
+        """
+        pass
+
 # generic class for counting checks
 class CountingCheck(Check):
 
@@ -26,13 +71,25 @@ class CountingCheck(Check):
     def _condition(self, frame):
         return True
 
+    def _batch_condition(self, frames):
+        return ones(len(frames), bool)
+
     def __call__(self, frame):
-        if self._condition(frame):
+        if isinstance(frame, ndarray):
+            count = int(self._batch_condition(frame).sum())
+            if count and self.cond_met_log_fmt:
+                log_msg = "condition met for {0} of {1} frames".format(count, len(frame))
+                self.logger.debug(log_msg)
+            self.results += count
+        elif self._condition(frame):
             if self.cond_met_log_fmt:
                 log_msg = self.cond_met_log_fmt.format(self)
                 self.logger.debug(log_msg)
             self.results += 1
 
+    def merge(self, other, contiguous=True):
+        self.results += other.results
+
 # Check to count when a frame val equals m
 class CountEqualTo(CountingCheck):
 
@@ -45,6 +102,10 @@ class CountEqualTo(CountingCheck):
         val = getattr(frame, self.attr)
         return val == self.m
 
+    def _batch_condition(self, frames):
+        cond = frames[self.attr] == asarray(self.m)
+        return cond.reshape(len(frames), -1).all(axis=1)
+
 # Check to count when a frame val is NOT equal to m
 class CountNotEqualTo(CountingCheck):
 
@@ -57,6 +118,10 @@ class CountNotEqualTo(CountingCheck):
         self.val = getattr(frame, self.attr)
         return not self.val == self.m
 
+    def _batch_condition(self, frames):
+        cond = frames[self.attr] == asarray(self.m)
+        return ~cond.reshape(len(frames), -1).all(axis=1)
+
 # Check to count when a frame val is out of range
 class CountOutOfRange(CountingCheck):
 
@@ -70,12 +135,17 @@ class CountOutOfRange(CountingCheck):
         self.val = getattr(frame, self.attr)
         return not self.start <= self.val <= self.stop
 
+    def _batch_condition(self, frames):
+        vals = frames[self.attr]
+        return ~((self.start <= vals) & (vals <= self.stop))
+
 # Check to count number of times frames are out of order
 class CountNotIncrementingBy(CountingCheck):
 
     def __init__(self, desc, attr, m):
         super(CountNotIncrementingBy, self).__init__(desc, attr)
         self.cond_met_log_fmt = "{0.attr} incremented from {0.last_val} to {0.val} (diff. of {0.diff} not {0.m})"
+        self.first_val = None
         self.last_val = None
         self.diff = None
         self.m = m
@@ -83,6 +153,7 @@ class CountNotIncrementingBy(CountingCheck):
     def _condition(self, frame):
         self.val = getattr(frame, self.attr)
         if self.last_val is None:
+            self.first_val = self.val
             self.last_val = self.val
             self.diff = 0
             return False
@@ -90,10 +161,56 @@ class CountNotIncrementingBy(CountingCheck):
             self.diff = self.val - self.last_val
             return not self.diff == self.m
 
+    def _batch_condition(self, frames):
+        vals = frames[self.attr].astype('i8')
+        if not len(vals):
+            return vals == self.m
+
+        # the first frame steps from the end of the last batch
+        if self.last_val is None:
+            self.first_val = int(vals[0])
+            prev_val = vals[:1]
+        else:
+            prev_val = asarray([self.last_val], 'i8')
+        diffs = vals - concatenate((prev_val, vals[:-1]))
+        if self.last_val is None:
+            diffs[0] = self.m
+
+        # remember where we finished for the next batch
+        self.val = int(vals[-1])
+        self.diff = int(diffs[-1])
+        return ~(diffs == self.m)
+
     def __call__(self, frame):
+        if isinstance(frame, ndarray) and not len(frame):
+            return
         super(CountNotIncrementingBy, self).__call__(frame)
         self.last_val = self.val
 
+    def merge(self, other, contiguous=True):
+        super(CountNotIncrementingBy, self).merge(other)
+
+        # nothing to reconcile if either side saw no frames
+        if other.first_val is None:
+            return
+        if self.last_val is None:
+            self.first_val = other.first_val
+            self.last_val = other.last_val
+            return
+        if not contiguous:
+            self.last_val = other.last_val
+            return
+
+        # check the step across the boundary
+        self.val = other.first_val
+        self.diff = self.val - self.last_val
+        if not self.diff == self.m:
+            if self.cond_met_log_fmt:
+                log_msg = self.cond_met_log_fmt.format(self)
+                self.logger.debug(log_msg)
+            self.results += 1
+        self.last_val = other.last_val
+
 # generic class for listing checks
 class ListingCheck(Check):
 
@@ -107,8 +224,513 @@ class ListingCheck(Check):
         return "{0:<40s}: {1}".format(self.desc, results)
 
     def __call__(self, frame):
+        if isinstance(frame, ndarray):
+            self._batch_call(frame)
+            return
         self.val = getattr(frame, self.attr)
         if self.val not in self.results:
             log_msg = self.new_val_log_fmt.format(self)
             self.logger.debug(log_msg)
             self.results.append(self.val)
+
+    @staticmethod
+    def _values(vals):
+        """ Return batch values as the per-frame headers have them
+
+        Numpy drops the trailing NULs of fixed-width byte strings (a
+        station ID of 0 comes out empty), so those are rebuilt from
+        their bytes, a character each as VDIFFrameHeader does.
+        """
+        if vals.dtype.kind != 'S':
+            return vals.tolist()
+        rows = ascontiguousarray(vals).view(uint8).reshape(len(vals), vals.dtype.itemsize)
+        return list(''.join(chr(byte) for byte in row) for row in rows.tolist())
+
+    def _batch_call(self, frames):
+
+        # find unique values in order of first appearance
+        vals, first_index = unique(frames[self.attr], return_index=True)
+        for val in self._values(vals[first_index.argsort()]):
+            self.val = val
+            if self.val not in self.results:
+                log_msg = self.new_val_log_fmt.format(self)
+                self.logger.debug(log_msg)
+                self.results.append(self.val)
+
+    def merge(self, other, contiguous=True):
+        for val in other.results:
+            if val not in self.results:
+                self.results.append(val)
+
+def estimate_rate(counts, frames, z=1.96):
+    """ Estimate a per-frame rate from counts over sampled windows of frames
+
+    Returns the rate with its lower and upper confidence bounds (95% for
+    the default z). Errors tend to cluster within windows, so the bounds
+    span both the binomial (Wilson) interval over all sampled frames and
+    the interval from the spread between windows.
+    """
+
+    counts = asarray(counts, float)
+    frames = asarray(frames, float)
+    total = frames.sum()
+    if not total:
+        return 0.0, 0.0, 1.0
+    rate = counts.sum() / total
+
+    # Wilson score interval, treating every frame as independent
+    denom = 1 + z**2 / total
+    center = (rate + z**2 / (2 * total)) / denom
+    half = z * sqrt(rate * (1 - rate) / total + z**2 / (4 * total**2)) / denom
+    lower, upper = center - half, center + half
+
+    # ratio estimator interval, treating every window as one sample
+    if len(counts) > 1:
+        resid = counts - rate * frames
+        std_err = sqrt((resid**2).sum() / (len(counts) * (len(counts) - 1))) / frames.mean()
+        lower, upper = min(lower, rate - z * std_err), max(upper, rate + z * std_err)
+
+    return rate, max(0.0, lower), min(1.0, upper)
+
+# an empty set of intervals, as (starts, stops)
+NO_INTERVALS = (zeros(0, 'i8'), zeros(0, 'i8'))
+
+def key_runs(keys):
+    """ Return sorted keys as (starts, stops) of [start, stop) runs of consecutive keys
+
+    Repeated keys start new runs, so the runs add up to len(keys).
+    """
+
+    keys = asarray(keys, 'i8')
+    if not len(keys):
+        return NO_INTERVALS
+    breaks = flatnonzero(diff(keys) != 1) + 1
+    return keys[concatenate(([0], breaks))], keys[concatenate((breaks - 1, [len(keys) - 1]))] + 1
+
+def combine_intervals(a, b, keep):
+    """ Combine sets of sorted, disjoint (starts, stops) intervals a and b
+
+    Returns the stretches where keep(in_a, in_b) holds, e.g. in_a | in_b
+    for the union or in_a & ~in_b for the difference.
+    """
+
+    points = unique(concatenate(tuple(a) + tuple(b)).astype('i8'))
+    if len(points) < 2:
+        return NO_INTERVALS
+
+    # whether each stretch [points[i], points[i+1]) lies in a and in b
+    lefts = points[:-1]
+    in_a = searchsorted(a[0], lefts, 'right') > searchsorted(a[1], lefts, 'right')
+    in_b = searchsorted(b[0], lefts, 'right') > searchsorted(b[1], lefts, 'right')
+    edges = diff(concatenate(([0], keep(in_a, in_b).astype('i1'), [0])))
+    return points[edges == 1], points[edges == -1]
+
+def union(a, b):
+    return combine_intervals(a, b, lambda in_a, in_b: in_a | in_b)
+
+def intersection(a, b):
+    return combine_intervals(a, b, lambda in_a, in_b: in_a & in_b)
+
+def difference(a, b):
+    return combine_intervals(a, b, lambda in_a, in_b: in_a & ~in_b)
+
+# Set of integer keys as sorted, disjoint [start, stop) intervals, kept
+# in arrays that grow at the top end, where new frames land. Updates
+# only rewrite the intervals above some key, so they cost about as much
+# as the frames that caused them. Duplicates, which can repeat, are
+# instead only ever extended, in no particular order.
+class KeyIntervals(object):
+
+    def __init__(self, starts=(), stops=()):
+        self.starts = array(starts, 'i8')
+        self.stops = array(stops, 'i8')
+        self.size = len(self.starts)
+        self.total = int((self.stops - self.starts).sum())
+
+    def __len__(self):
+        return self.size
+
+    def __getstate__(self):
+        # only pickle what is in use
+        state = self.__dict__.copy()
+        state['starts'] = self.starts[:self.size].copy()
+        state['stops'] = self.stops[:self.size].copy()
+        return state
+
+    def intervals(self, above=None):
+        """ Return (starts, stops) of all intervals, or of those ending above a key """
+        first = 0 if above is None else self._first_above(above)
+        return self.starts[first:self.size], self.stops[first:self.size]
+
+    def replace_above(self, above, starts, stops):
+        """ Replace the intervals ending above a key with new ones, none of which end below it """
+
+        first = self._first_above(above)
+        self.total -= int((self.stops[first:self.size] - self.starts[first:self.size]).sum())
+
+        # join up with an interval ending right where the new ones start
+        if first and len(starts) and self.stops[first - 1] == starts[0]:
+            first -= 1
+            starts = concatenate(([self.starts[first]], starts[1:]))
+            self.total -= int(self.stops[first] - self.starts[first])
+
+        self.size = first
+        self.extend(starts, stops)
+
+    def extend(self, starts, stops):
+        """ Add intervals after the others """
+        size = self.size + len(starts)
+        if size > len(self.starts):
+            capacity = max(size, 2 * len(self.starts), 16)
+            for name in ('starts', 'stops'):
+                grown = zeros(capacity, 'i8')
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        self.starts[self.size:size] = starts
+        self.stops[self.size:size] = stops
+        self.size = size
+        self.total += int((asarray(stops, 'i8') - asarray(starts, 'i8')).sum())
+
+    def stop_below(self, key):
+        """ Return the stop of the last interval ending at or below a key, as an array of one, or none """
+        first = self._first_above(key)
+        return self.stops[first - 1:first] if first else self.stops[:0]
+
+    def shift(self, offset):
+        """ Move every interval by offset """
+        self.starts[:self.size] += offset
+        self.stops[:self.size] += offset
+
+    def _first_above(self, key):
+        return int(searchsorted(self.stops[:self.size], key, 'right'))
+
+# Check frame continuity per stream, keyed on the PSN when it counts and
+# otherwise on the frame count since epoch, which is wrap-aware across
+# data_frame rollovers. Every stream keeps the keys it has seen, the
+# gaps of lost keys among them, and the keys that arrived after a
+# higher one (reordered) or more than once (duplicates), all as
+# intervals. A batch of frames and the results of a check over the
+# frames that follow are folded in the same way, replaying no history.
+class ContinuityCheck(Check):
+
+    def __init__(self, desc, frames_per_second):
+        super(ContinuityCheck, self).__init__(desc, 'psn')
+        self.fields = CONTINUITY_FIELDS
+        self.frames_per_second = frames_per_second
+        self.streams = {}
+        self._summarize()
+
+    def __str__(self):
+        results = ', '.join('{0} {1}'.format(v, k) for k, v in sorted(self.results.items()))
+        return "{0:<40s}: {1}".format(self.desc, results)
+
+    def __call__(self, frame):
+        if not isinstance(frame, ndarray):
+            frame = array([tuple(getattr(frame, name) for name in CONTINUITY_FIELDS)], CONTINUITY_DTYPE)
+        if not len(frame):
+            return
+
+        # split the frames into streams
+        station_id = ascontiguousarray(frame['station_id']).view('>u2')
+        stream_ids = (station_id.astype('i8') << 16) | frame['thread_id']
+        for stream_id in unique(stream_ids):
+            in_stream = stream_ids == stream_id
+            state = self._stream(int(stream_id))
+
+            # frame count since epoch, and the PSN
+            tc = frame['secs_since_epoch'][in_stream].astype('i8') * self.frames_per_second
+            tc += frame['data_frame'][in_stream]
+            psn = frame['psn'][in_stream].astype('i8')
+
+            # key on the PSN once the stream shows it counting
+            use_psn = state['use_psn']
+            if use_psn is None:
+                use_psn = self._psn_counts(psn, state['pending'] is not None)
+            if use_psn is None:
+                self._fold(state, dict(self._new_stream(), pending=int(tc[0])))
+            else:
+                self._fold(state, self._frames_stream(psn if use_psn else tc, tc, use_psn))
+
+        self._summarize()
+
+    def merge(self, other, contiguous=True):
+        for stream_id, other_state in sorted(other.streams.items()):
+            self._fold(self._stream(stream_id), other_state, contiguous)
+        self._summarize()
+
+    def gap_map(self):
+        """ Return (thread_id, station_id, kind, key, count, secs_since_epoch, data_frame) per event """
+
+        events = []
+        for stream_id, state in sorted(self.streams.items()):
+            if state['offset'] is None:
+                continue
+            thread_id = stream_id & 0xffff
+            station_id = ''.join((chr((stream_id >> 24) & 0xff), chr((stream_id >> 16) & 0xff)))
+            for kind in ('lost', 'duplicate', 'reorder'):
+                starts, stops = state[kind].intervals()
+                if kind == 'duplicate':
+                    starts, stops = self._join_adjacent(starts, stops)
+                for key, stop in zip(starts.tolist(), stops.tolist()):
+                    secs, data_frame = divmod(key + state['offset'], self.frames_per_second)
+                    events.append((thread_id, station_id, kind, key, stop - key, secs, data_frame))
+
+        return sorted(events, key=lambda event: (event[0], event[1], event[3]))
+
+    @staticmethod
+    def _join_adjacent(starts, stops):
+        """ Sort duplicate intervals, joining each to one that ends where it starts """
+        joined = []
+        for start, stop in sorted(zip(starts.tolist(), stops.tolist())):
+            if joined and joined[-1][1] == start:
+                joined[-1][1] = stop
+            else:
+                joined.append([start, stop])
+        return asarray(joined, 'i8').reshape(-1, 2).T
+
+    @staticmethod
+    def _psn_counts(psn, zero_before):
+        """ Return whether the PSNs of a stream count, or None if it cannot tell yet
+
+        A counting PSN is 0 for the first frame at most, so it counts if
+        a non-zero PSN comes before any second 0.
+        """
+
+        zeros_at = flatnonzero(psn == 0)
+        nonzero_at = flatnonzero(psn != 0)
+        second_zero = zeros_at[1 - zero_before] if len(zeros_at) > 1 - zero_before else None
+        if len(nonzero_at) and (second_zero is None or nonzero_at[0] < second_zero):
+            return True
+        if second_zero is not None:
+            return False
+        return None
+
+    def _stream(self, stream_id):
+        if stream_id not in self.streams:
+            self.streams[stream_id] = self._new_stream()
+        return self.streams[stream_id]
+
+    @staticmethod
+    def _new_stream(use_psn=None):
+        # until the keying is settled, the one frame seen (with PSN 0) is
+        # pending, as its frame count; `offset` is frame count minus key
+        return dict(
+            use_psn=use_psn, pending=None, offset=None, first=None, last=None, hwm=None, time_errors=0,
+            seen=KeyIntervals(), lost=KeyIntervals(), reorder=KeyIntervals(), duplicate=KeyIntervals(),
+            )
+
+    def _frames_stream(self, keys, tc, use_psn):
+        """ Return the state of a stream that has only seen frames with these keys and frame counts, in order """
+
+        state = self._new_stream(use_psn)
+        keys, tc = asarray(keys, 'i8'), asarray(tc, 'i8')
+
+        # first arrivals below a key seen before came late, the rest were seen already
+        unique_keys, first_index = unique(keys, return_index=True)
+        first_seen = zeros(len(keys), bool)
+        first_seen[first_index] = True
+        before = maximum.accumulate(concatenate((keys[:1], keys[:-1])))
+        seen = key_runs(unique_keys)
+        state['seen'] = KeyIntervals(*seen)
+        state['lost'] = KeyIntervals(seen[1][:-1], seen[0][1:])
+        state['reorder'] = KeyIntervals(*key_runs(unique(keys[first_seen & (keys < before)])))
+        state['duplicate'] = KeyIntervals(*key_runs(sort(keys[~first_seen])))
+
+        state['hwm'] = int(unique_keys[-1])
+        state['offset'] = int(tc[0] - keys[0])
+        state['first'] = (int(keys[0]), int(tc[0]))
+        state['last'] = (int(keys[-1]), int(tc[-1]))
+
+        # count PSN steps that disagree with the timestamps
+        if use_psn:
+            state['time_errors'] = int(((diff(keys) == 1) & (diff(tc) != 1)).sum())
+        return state
+
+    def _fold(self, state, other, contiguous=True):
+        """ Fold the state of a stream over the frames that follow into ours, settling the keying of both """
+
+        # an unsettled stream has seen one frame at most, with PSN 0
+        if other['use_psn'] is None:
+            if other['pending'] is None:
+                return
+            tc = other['pending']
+            if state['use_psn'] is None:
+                if state['pending'] is None:
+                    state['pending'] = tc
+                else:
+                    # two frames with PSN 0, so it is not counting
+                    state.update(self._frames_stream([state['pending'], tc], [state['pending'], tc], False))
+                return
+            other = self._frames_stream([0 if state['use_psn'] else tc], [tc], state['use_psn'])
+        elif state['use_psn'] is None:
+            tc = state['pending']
+            if tc is None:
+                state['use_psn'] = other['use_psn']
+            else:
+                state.update(self._frames_stream([0 if other['use_psn'] else tc], [tc], other['use_psn']))
+
+        # streams keyed differently, e.g. in separate chunks, fall back to frame counts
+        elif state['use_psn'] != other['use_psn']:
+            self._key_on_frame_count(state if state['use_psn'] else other)
+
+        self._merge_stream(state, other, contiguous)
+
+    def _merge_stream(self, state, other, contiguous):
+        """ Merge the state of an equally keyed stream over the frames that follow into ours """
+
+        if other['hwm'] is None:
+            return
+        if state['hwm'] is None:
+            state.update(other)
+            return
+
+        # nothing changes below the lowest key of the other frames, or
+        # below where ours would continue
+        other_seen = other['seen'].intervals()
+        hwm = state['hwm']
+        low = min(int(other_seen[0][0]), hwm + 1)
+        seen = state['seen'].intervals(low)
+
+        # every key missing between those seen is lost, and new keys below
+        # our highest came late; separate samples only lose their own keys
+        merged = union(seen, other_seen)
+        if contiguous:
+            fill = ([low], [hwm + 1])
+            below = state['seen'].stop_below(low)
+            hole_starts = concatenate((below, merged[1][:-1]))
+            hole_stops = concatenate((merged[0][:1] if len(below) else merged[0][:0], merged[0][1:]))
+            holes = hole_stops > hole_starts
+            lost = hole_starts[holes], hole_stops[holes]
+            lost_low = int(below[0]) if len(below) else low
+        else:
+            fill = NO_INTERVALS
+            lost = union(difference(state['lost'].intervals(low), other_seen),
+                         difference(other['lost'].intervals(), seen))
+            lost_low = low
+        reorder = union(state['reorder'].intervals(low),
+                        union(difference(other['reorder'].intervals(), seen),
+                              intersection(difference(other_seen, seen), fill)))
+
+        # keys seen on both sides came again
+        state['duplicate'].extend(*other['duplicate'].intervals())
+        state['duplicate'].extend(*intersection(other_seen, seen))
+        state['seen'].replace_above(low, *merged)
+        state['lost'].replace_above(lost_low, *lost)
+        state['reorder'].replace_above(low, *reorder)
+
+        # check the PSN step across the boundary
+        if contiguous and state['use_psn']:
+            (last_key, last_tc), (first_key, first_tc) = state['last'], other['first']
+            if first_key - last_key == 1 and not first_tc - last_tc == 1:
+                state['time_errors'] += 1
+        state['time_errors'] += other['time_errors']
+        state['hwm'] = max(hwm, other['hwm'])
+        state['last'] = other['last']
+
+    @staticmethod
+    def _key_on_frame_count(state):
+        """ Rekey a PSN-keyed stream on frame counts, as of its first frame """
+        offset = state['offset']
+        for kind in ('seen', 'lost', 'reorder', 'duplicate'):
+            state[kind].shift(offset)
+        state['hwm'] += offset
+        state['first'] = (state['first'][1], state['first'][1])
+        state['last'] = (state['last'][1], state['last'][1])
+        state['offset'] = 0
+        state['use_psn'] = False
+
+    def _summarize(self):
+        self.results = dict(lost=0, duplicate=0, reorder=0, time_errors=0)
+        for state in self.streams.values():
+            for kind in ('lost', 'duplicate', 'reorder'):
+                self.results[kind] += state[kind].total
+            self.results['time_errors'] += state['time_errors']
+
+# payload check, called per frame with a header object and its packed
+# payload or per batch with headers and a 2-D array of payloads
+class StateOccupancyCheck(Check):
+
+    needs_payload = True
+
+    def __init__(self, desc, tolerance=5.0, ideal=IDEAL_2BIT_OCCUPANCY):
+        super(StateOccupancyCheck, self).__init__(desc, 'bits_per_sample')
+        self.fields = ('bits_per_sample', 'thread_id', 'secs_since_epoch')
+        self.tolerance = tolerance
+        self.ideal = array(ideal, float)
+        self.bits_per_sample = int(log2(len(ideal)))
+        self.counts = {}
+        self.flagged = set()
+        self.results = 0
+
+    def __str__(self):
+        return "{0:<40s}: {1} of {2} thread-seconds off ideal by > {3} %".format(
+            self.desc, self.results, len(self.counts), self.tolerance)
+
+    def __call__(self, frame, payload=None):
+        if not isinstance(frame, ndarray):
+            key = (int(frame.thread_id), int(frame.secs_since_epoch))
+            self._add_counts(key, state_counts(payload, self.bits_per_sample))
+            self.logger.debug("thread {0} secs {1}: {2}".format(key[0], key[1], self.counts[key]))
+            return
+
+        # only frames with the expected sample width are counted
+        match = frame['bits_per_sample'] == self.bits_per_sample
+        if not match.any():
+            return
+        payload = asarray(payload)
+        group_ids = (frame['thread_id'].astype('i8') << 32) | frame['secs_since_epoch']
+
+        # runs of consecutive frames from one (thread, second) group
+        bounds = flatnonzero((group_ids[1:] != group_ids[:-1]) | (match[1:] != match[:-1])) + 1
+        starts = concatenate(([0], bounds))
+        stops = concatenate((bounds, [len(frame)]))
+
+        # histogram the groups straight from the packed bytes, without
+        # copying payloads: a slice per run when the runs are long, else
+        # one bincount on the group index for interleaved threads
+        counts = {}
+        if len(starts) * MIN_RUN_FRAMES <= len(frame):
+            for start, stop in zip(starts[match[starts]], stops[match[starts]]):
+                key = int(group_ids[start])
+                run_counts = state_counts(payload[start:stop], self.bits_per_sample)
+                counts[key] = counts[key] + run_counts if key in counts else run_counts
+        else:
+            keys, groups = unique(group_ids, return_inverse=True)
+            groups = groups.reshape(-1)
+            present = bincount(groups[match], minlength=len(keys)) > 0
+            groups[~match] = -1
+            group_counts = group_state_counts(payload, groups, len(keys), self.bits_per_sample)
+            counts = dict((int(key), group_counts[i]) for i, key in enumerate(keys) if present[i])
+
+        for group_id in sorted(counts):
+            self._add_counts((group_id >> 32, group_id & 0xffffffff), counts[group_id])
+
+        self.logger.debug("{0} thread-seconds off ideal so far".format(self.results))
+
+    def merge(self, other, contiguous=True):
+        for key, counts in other.counts.items():
+            self._add_counts(key, counts)
+
+    def occupancy(self):
+        """ Return (thread_id, secs, percent per state, flagged) for every thread-second """
+        return list(
+            (thread_id, secs, self._percent((thread_id, secs)), (thread_id, secs) in self.flagged)
+            for thread_id, secs in sorted(self.counts)
+            )
+
+    def _percent(self, key):
+        counts = self.counts[key]
+        return 100.0 * counts / max(1, counts.sum())
+
+    def _add_counts(self, key, counts):
+        if key in self.counts:
+            self.counts[key] = self.counts[key] + counts
+        else:
+            self.counts[key] = counts
+
+        # flag the period if any state is too far from its ideal share
+        if abs(self._percent(key) - self.ideal).max() > self.tolerance:
+            self.flagged.add(key)
+        else:
+            self.flagged.discard(key)
+        self.results = len(self.flagged)
@@ -0,0 +1,272 @@
+import logging
+from os import fstat
+from os.path import basename
+from glob import glob
+from mmap import mmap, ACCESS_READ
+from struct import unpack_from, calcsize
+from multiprocessing.pool import ThreadPool
+
+from numpy import uint8, zeros, empty, ndarray, frombuffer, concatenate, cumsum, searchsorted, dtype
+
+from vdif import VDIFFile, VDIFFrameHeader, headers_from_bin, HEADER_DTYPE
+
+# where a Mark6 keeps the scatter-gather files of a scan, one per disk
+MARK6_DATA_GLOB = '/mnt/disks/[1-4]/[0-7]/data/{0}'
+
+# file header: sync word, version, block size, packet format, packet size
+SG_FILE_HEADER_FMT = '<Iiiii'
+SG_FILE_HEADER_SIZE = calcsize(SG_FILE_HEADER_FMT)
+SG_SYNC_WORD = 0xfeed6666
+SG_PACKET_FORMAT_VDIF = 0
+
+# block header: block number, and from version 2 on the block size
+# (header included); version 1 blocks all have the file's block size
+SG_BLOCK_HEADER_FMTS = {1: '<i', 2: '<ii'}
+
+# one record per block of frames, in block number order
+SG_BLOCK_DTYPE = dtype([
+    ('blocknum', '<i8'),
+    ('file_n', '<i4'),
+    ('offset', '<u8'),
+    ('frames', '<i8'),
+    ('first_frame', '<i8'),
+    ])
+
+logger = logging.getLogger('mark6_sg')
+
+
+def find_scan(name, data_glob=MARK6_DATA_GLOB):
+    """ Return the scatter-gather files of a scan, given its name or a glob pattern """
+
+    filenames = glob(name)
+    if not filenames:
+        filenames = glob(data_glob.format(name))
+    if not filenames:
+        raise ValueError('no scatter-gather files found for {0}'.format(name))
+    return sorted(filenames)
+
+
+def open_recording(name, mark6=False, skip_bytes=0, sample_rate=4096e6):
+    """ Open either a plain VDIF file or, if `mark6`, a scatter-gather scan """
+
+    if mark6:
+        return Mark6SGFile(find_scan(name), sample_rate=sample_rate)
+    return VDIFFile(name, skip_bytes=skip_bytes, sample_rate=sample_rate)
+
+
+class Mark6SGFile(VDIFFile):
+    """ Mark6 scatter-gather scan read as one in-order VDIF file
+
+    The recorder writes blocks of frames round-robin to one file per
+    disk. All file and block headers are parsed up front into `blocks`,
+    ordered by block number, so frame n can be found with a bisect.
+
+    Frames and payloads within a block are views of the mapped disk
+    files, as for VDIFFile. Ranges that span blocks are gathered into
+    a new array with one read per block, spread over `threads` threads
+    (default: one per file) so that all disks are read at once.
+    """
+
+    def __init__(self, filenames, frame_size=None, sample_rate=4096e6, threads=None):
+        self.filenames = list(filenames)
+        if not self.filenames:
+            raise ValueError('no scatter-gather files given')
+        self.filename = basename(self.filenames[0])
+        self.skip_bytes = 0
+        self.sample_rate = sample_rate
+        self.trailing_bytes = 0
+        self.index_filename = None
+        self.index = None
+        self.threads = threads or len(self.filenames)
+        self._pool = None
+
+        # map every file and index the blocks in it
+        self._files, self._mmaps, self._bytes = [], [], []
+        blocks = []
+        for file_n, filename in enumerate(self.filenames):
+            file_ = open(filename, 'rb')
+            file_size = fstat(file_.fileno()).st_size
+            self._files.append(file_)
+            self._mmaps.append(mmap(file_.fileno(), 0, access=ACCESS_READ) if file_size else None)
+            self._bytes.append(frombuffer(self._mmaps[-1], uint8) if file_size else zeros(0, uint8))
+
+            # check the file header
+            if file_size < SG_FILE_HEADER_SIZE:
+                self.close()
+                raise ValueError('{0} is not a scatter-gather file'.format(filename))
+            sync_word, version, block_size, packet_format, packet_size = unpack_from(
+                SG_FILE_HEADER_FMT, self._mmaps[-1])
+            if sync_word != SG_SYNC_WORD or version not in SG_BLOCK_HEADER_FMTS:
+                self.close()
+                raise ValueError('{0} is not a scatter-gather file'.format(filename))
+            if packet_format != SG_PACKET_FORMAT_VDIF:
+                self.close()
+                raise ValueError('{0} does not hold VDIF packets'.format(filename))
+            if frame_size is None:
+                frame_size = packet_size
+            elif packet_size != frame_size:
+                logger.warning('{0} has {1} byte packets, reading {2} byte frames'.format(
+                    filename, packet_size, frame_size))
+
+            # walk the block headers
+            block_fmt = SG_BLOCK_HEADER_FMTS[version]
+            block_header_size = calcsize(block_fmt)
+            offset = SG_FILE_HEADER_SIZE
+            while offset + block_header_size <= file_size:
+                fields = unpack_from(block_fmt, self._mmaps[-1], offset)
+                blocknum, wb_size = fields if version > 1 else (fields[0], block_size)
+
+                # a zeroed or garbled header ends the usable part of the file
+                if blocknum < 0 or wb_size <= block_header_size:
+                    logger.warning('bad block header at byte {0} of {1}, ignoring the rest'.format(offset, filename))
+                    break
+
+                # a block cut short by the end of the file keeps its whole frames
+                data_size = min(wb_size, file_size - offset) - block_header_size
+                blocks.append((blocknum, file_n, offset + block_header_size, data_size // frame_size, 0))
+                offset += wb_size
+
+        self.frame_size = frame_size
+
+        # put the blocks in recording order and number their frames
+        self.blocks = zeros(len(blocks), SG_BLOCK_DTYPE)
+        for n, block in enumerate(sorted(blocks)):
+            self.blocks[n] = block
+        self.blocks['first_frame'] = cumsum(self.blocks['frames']) - self.blocks['frames']
+        self._len = int(self.blocks['frames'].sum())
+
+        # get the frame layout from the first header
+        self.header_size = 32
+        if self._len:
+            first_hdr = VDIFFrameHeader.from_bin(self[0])
+            self.header_size = 16 if first_hdr.legacy_mode else 32
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            return self.read(start, max(start, stop), step)
+
+        # a single frame is a view of the file it is in
+        frame_n = key + len(self) if key < 0 else key
+        if not 0 <= frame_n < len(self):
+            raise IndexError('frame {0} out of range'.format(key))
+        block_n = searchsorted(self.blocks['first_frame'], frame_n, 'right') - 1
+        block = self.blocks[block_n]
+        start = int(block['offset']) + (frame_n - int(block['first_frame'])) * self.frame_size
+        return self._bytes[block['file_n']][start:start + self.frame_size]
+
+    def _segments(self, start, stop, step=1):
+        """ Split every step-th frame of [start, stop) into (block_n, first, count, out_n) pieces """
+
+        segments = []
+        out_n = 0
+        lo = searchsorted(self.blocks['first_frame'], start, 'right') - 1
+        hi = searchsorted(self.blocks['first_frame'], stop, 'left')
+        for block_n in range(max(0, lo), hi):
+            first_frame = int(self.blocks['first_frame'][block_n])
+            block_stop = min(stop, first_frame + int(self.blocks['frames'][block_n]))
+
+            # first wanted frame in this block
+            first = max(start, first_frame)
+            first += -(first - start) % step
+            if first < block_stop:
+                count = -(-(block_stop - first) // step)
+                segments.append((block_n, first - first_frame, count, out_n))
+                out_n += count
+
+        return segments
+
+    def _block_frames(self, block_n):
+        block = self.blocks[block_n]
+        start = int(block['offset'])
+        stop = start + int(block['frames']) * self.frame_size
+        return self._bytes[block['file_n']][start:stop].reshape(-1, self.frame_size)
+
+    def read(self, start=None, stop=None, step=1, out=None):
+        """ Read every step-th frame of [start, stop) into a 2-D array, all disks at once """
+
+        start, stop = self._range(start, stop)
+        segments = self._segments(start, stop, step)
+        count = sum(segment[2] for segment in segments)
+        if out is None:
+            out = empty((count, self.frame_size), uint8)
+
+        def copy(segment):
+            block_n, first, count, out_n = segment
+            out[out_n:out_n + count] = self._block_frames(block_n)[first:first + step * (count - 1) + 1:step]
+
+        # each block comes off one disk, so read them in parallel
+        if len(segments) > 1 and self.threads > 1:
+            if self._pool is None:
+                self._pool = ThreadPool(self.threads)
+            self._pool.map(copy, segments)
+        else:
+            for segment in segments:
+                copy(segment)
+
+        return out
+
+    def headers(self, start=None, stop=None):
+        """ Return the headers of frames [start, stop) as a structured array """
+
+        start, stop = self._range(start, stop)
+        blocks = []
+        for block_n, first, count, _ in self._segments(start, stop):
+            block = self.blocks[block_n]
+            offset = int(block['offset']) + first * self.frame_size
+            blocks.append(headers_from_bin(self._bytes[block['file_n']], self.frame_size, count, offset))
+        return concatenate(blocks) if blocks else zeros(0, HEADER_DTYPE)
+
+    def header_words(self, start=None, stop=None, step=1):
+        """ Return the uint32 header words of every step-th frame of [start, stop)
+
+        This is a view of the file if the frames are all in one block,
+        and a copy gathered block by block otherwise.
+        """
+
+        start, stop = self._range(start, stop)
+        segments = self._segments(start, stop, step)
+        out = None
+        for block_n, first, count, out_n in segments:
+            block = self.blocks[block_n]
+            words = ndarray((count, self.header_size // 4), '<u4', buffer=self._bytes[block['file_n']],
+                            offset=int(block['offset']) + first * self.frame_size, strides=(step * self.frame_size, 4))
+            if len(segments) == 1:
+                return words
+            if out is None:
+                out = empty((sum(segment[2] for segment in segments), self.header_size // 4), '<u4')
+            out[out_n:out_n + count] = words
+        return out if out is not None else zeros((0, self.header_size // 4), '<u4')
+
+    def payloads(self, start=None, stop=None, step=1):
+        """ Return the payloads of every step-th frame of [start, stop)
+
+        This is a view of the file if the frames are all in one block,
+        and a parallel read otherwise.
+        """
+
+        start, stop = self._range(start, stop)
+        segments = self._segments(start, stop, step)
+        if len(segments) == 1:
+            block_n, first, count, _ = segments[0]
+            return self._block_frames(block_n)[first:first + step * (count - 1) + 1:step, self.header_size:]
+        return self.read(start, stop, step)[:, self.header_size:]
+
+    def build_index(self, block_frames=None):
+        raise ValueError('scatter-gather scans are not indexed, their block index is built on open')
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._bytes = []
+
+        # views handed out hold on to the maps, which are unmapped once
+        # the last of them is gone, as for VDIFFile
+        self._mmaps = []
+        for file_ in self._files:
+            file_.close()
+        self._files = []
@@ -0,0 +1,148 @@
+import pickle
+import unittest
+
+from numpy import array, arange, zeros, int64, uint8
+
+import checks
+from vdif import VDIFFrameHeader, frames_to_bin, headers_from_bin
+from tests.vdif_frames import frame_headers
+
+SAMPLES_PER_FRAME = 64
+
+
+def make_frames(station_ids):
+    """ Return the bytes of one frame per station ID, with zero samples """
+    hdrs = frame_headers(len(station_ids), SAMPLES_PER_FRAME, station_id=list(station_ids), secs_since_epoch=1000)
+    return bytes(frames_to_bin(hdrs, zeros((len(hdrs), SAMPLES_PER_FRAME), int64)))
+
+
+class ListingCheckTest(unittest.TestCase):
+
+    def listings(self, station_ids):
+        """ Return the station IDs listed per frame and per batch """
+        bin_frames = make_frames(station_ids)
+        frame_size = len(bin_frames) // len(station_ids)
+
+        per_frame = checks.ListingCheck('station IDs', 'station_id')
+        for frame_n in range(len(station_ids)):
+            per_frame(VDIFFrameHeader.from_bin(bin_frames[frame_n * frame_size:(frame_n + 1) * frame_size]))
+
+        batch = checks.ListingCheck('station IDs', 'station_id')
+        batch(headers_from_bin(bin_frames, frame_size))
+        return per_frame.results, batch.results
+
+    def test_station_zero(self):
+        per_frame, batch = self.listings([0, 0])
+        self.assertEqual(per_frame, ['\x00\x00'])
+        self.assertEqual(batch, per_frame)
+        self.assertEqual(str(batch), str(per_frame))
+
+    def test_trailing_nul(self):
+        per_frame, batch = self.listings([0x4100, 0x4141, 0x4100, 0x0041])
+        self.assertEqual(per_frame, ['A\x00', 'AA', '\x00A'])
+        self.assertEqual(batch, per_frame)
+
+
+class StateOccupancyCheckTest(unittest.TestCase):
+
+    def check_against_per_frame(self, thread_ids, wide):
+        """ Compare batch state counts with per-frame ones, skipping 4-bit frames """
+        frames = zeros(len(thread_ids), [('bits_per_sample', 'u1'), ('thread_id', '<u2'), ('secs_since_epoch', '<u4')])
+        frames['thread_id'] = thread_ids
+        frames['secs_since_epoch'] = 1000 + arange(len(frames)) // 40
+        frames['bits_per_sample'] = 2
+        frames['bits_per_sample'][wide] = 4
+
+        # payloads with a header in front, a strided view as vdif_check passes them
+        packed = (arange(len(frames) * 40) * 37 % 256).astype(uint8).reshape(len(frames), 40)
+        payloads = packed[:, 8:]
+
+        batch = checks.StateOccupancyCheck('occupancy')
+        batch(frames, payloads)
+
+        per_frame = checks.StateOccupancyCheck('occupancy')
+        for frame, payload in zip(frames, payloads):
+            if frame['bits_per_sample'] == 2:
+                hdr = VDIFFrameHeader()
+                hdr.thread_id, hdr.secs_since_epoch = int(frame['thread_id']), int(frame['secs_since_epoch'])
+                per_frame(hdr, payload)
+
+        self.assertEqual(sorted(batch.counts), sorted(per_frame.counts))
+        for key in per_frame.counts:
+            self.assertEqual(batch.counts[key].tolist(), per_frame.counts[key].tolist())
+        self.assertEqual(batch.flagged, per_frame.flagged)
+
+    def test_thread_runs(self):
+        self.check_against_per_frame(arange(200) // 100, slice(150, 160))
+
+    def test_interleaved_threads(self):
+        self.check_against_per_frame(arange(200) % 4, slice(None, None, 7))
+
+
+FRAMES_PER_SECOND = 100
+
+
+def continuity_frames(frame_counts, psns):
+    """ Return one thread's continuity records for the given frame counts and PSNs """
+    frame_counts = array(frame_counts)
+    frames = zeros(len(frame_counts), checks.CONTINUITY_DTYPE)
+    frames['secs_since_epoch'] = frame_counts // FRAMES_PER_SECOND
+    frames['data_frame'] = frame_counts % FRAMES_PER_SECOND
+    frames['psn'] = psns
+    frames['station_id'] = b'AB'
+    return frames
+
+
+class ContinuityCheckTest(unittest.TestCase):
+
+    # 2 lost (3, 6), 1 duplicate (2), 1 reordered (5 after 7)
+    FRAME_COUNTS = [1000, 1001, 1002, 1002, 1004, 1007, 1005, 1008]
+    EXPECTED = {'lost': 2, 'duplicate': 1, 'reorder': 1, 'time_errors': 0}
+
+    def check(self, frames, split=None):
+        """ Run ContinuityCheck over frames: in one batch, or per chunk merged afterwards """
+        if split is None:
+            check = checks.ContinuityCheck('continuity', FRAMES_PER_SECOND)
+            check(frames)
+            return check
+        total = checks.ContinuityCheck('continuity', FRAMES_PER_SECOND)
+        for start, stop in zip([0] + split, split + [len(frames)]):
+            check = checks.ContinuityCheck('continuity', FRAMES_PER_SECOND)
+            check(frames[start:stop])
+            total.merge(pickle.loads(pickle.dumps(check, 2)))
+        return total
+
+    def test_batch_per_frame_and_chunks_agree(self):
+        frames = continuity_frames(self.FRAME_COUNTS, 0)
+        self.assertEqual(self.check(frames).results, self.EXPECTED)
+        self.assertEqual(self.check(frames, split=list(range(1, len(frames)))).results, self.EXPECTED)
+        self.assertEqual(self.check(frames, split=[3, 6]).results, self.EXPECTED)
+
+    def test_psn_from_zero_per_frame(self):
+        # the PSN starts at 0 and keeps counting while the frame count jumps
+        frames = continuity_frames([1000, 1001, 1002, 1003, 1050], [0, 1, 2, 4, 5])
+        expected = {'lost': 1, 'duplicate': 0, 'reorder': 0, 'time_errors': 1}
+        for split in (None, [1, 2, 3, 4]):
+            check = self.check(frames, split)
+            self.assertTrue(check.streams[(0x4142 << 16)]['use_psn'])
+            self.assertEqual(check.results, expected)
+
+    def test_zero_psn_keys_on_frame_count(self):
+        frames = continuity_frames(self.FRAME_COUNTS, 0)
+        check = self.check(frames, split=[1])
+        self.assertFalse(check.streams[(0x4142 << 16)]['use_psn'])
+        self.assertEqual(check.results, self.EXPECTED)
+
+    def test_sampled_windows_add_up(self):
+        frames = continuity_frames(self.FRAME_COUNTS, 0)
+        total = checks.ContinuityCheck('continuity', FRAMES_PER_SECOND)
+        for start, stop in ((0, 3), (5, 8)):
+            check = checks.ContinuityCheck('continuity', FRAMES_PER_SECOND)
+            check(frames[start:stop])
+            total.merge(check, contiguous=False)
+        # the frames skipped between windows are not lost
+        self.assertEqual(total.results, {'lost': 1, 'duplicate': 0, 'reorder': 1, 'time_errors': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from numpy import arange, uint8, int64
+from numpy.random import RandomState
+
+import correlator
+from vdif import VDIFFile, decode_samples
+from tests.vdif_frames import frame_headers, write_frames
+
+SAMPLES_PER_FRAME = 1024
+NFFT = 256
+N_FRAMES = 24
+
+
+class LagProductsTest(unittest.TestCase):
+
+    def check_against_samples(self, bits_per_sample, n_bytes, max_lag, chunk_bytes):
+        """ Compare lag_products with sums over the decoded samples """
+        x_bytes = (arange(n_bytes) * 73 % 251).astype(uint8)
+        y_bytes = (arange(n_bytes) * 31 % 241 + 7).astype(uint8)
+        x = decode_samples(x_bytes, bits_per_sample, dtype=float) + 0.5
+        y = decode_samples(y_bytes, bits_per_sample, dtype=float) + 0.5
+
+        sums = correlator.lag_products(x_bytes, y_bytes, max_lag, bits_per_sample, chunk_bytes=chunk_bytes)
+        self.assertEqual(len(sums), 2 * max_lag + 1)
+        for lag in range(-max_lag, max_lag + 1):
+            overlap = max(0, len(x) - abs(lag))
+            expected = (x[max(0, -lag):][:overlap] * y[max(0, lag):][:overlap]).sum()
+            self.assertAlmostEqual(sums[lag + max_lag], expected)
+
+    def test_2bit(self):
+        self.check_against_samples(2, 1000, 40, correlator.LAG_CHUNK_BYTES)
+
+    def test_chunks(self):
+        for bits_per_sample in (1, 2, 4, 8):
+            self.check_against_samples(bits_per_sample, 300, 25, 37)
+
+    def test_lags_beyond_data(self):
+        self.check_against_samples(4, 10, 30, 4)
+
+
+class FXCorrelatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        data = RandomState(1).randint(-2, 2, (N_FRAMES, SAMPLES_PER_FRAME)).astype(int64)
+
+        # the second station sees the same signal, and marks frames 3 and 4
+        # invalid; the first marks frame 10 invalid and sends junk in it
+        self.sources = []
+        for station_id, invalid in ((0x4141, (10,)), (0x4242, (3, 4))):
+            hdrs = frame_headers(N_FRAMES, SAMPLES_PER_FRAME, station_id=station_id,
+                                 invalid_data=list(frame_n in invalid for frame_n in range(N_FRAMES)))
+            station_data = data.copy()
+            station_data[list(invalid)] = 1
+            filename = os.path.join(self.tmp_dir, '{0:x}.vdif'.format(station_id))
+            write_frames(filename, hdrs, station_data)
+            self.sources.append(VDIFFile(filename))
+
+    def tearDown(self):
+        for source in self.sources:
+            source.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_invalid_frames_left_out(self):
+        fx = correlator.FXCorrelator(self.sources, [0, 0], NFFT, N_FRAMES, frames_per_batch=8)
+        (first, frames, vis), = list(fx.dumps())
+        self.assertEqual(frames, N_FRAMES - 3)
+
+        # the same as correlating the valid stretches alone
+        expected = sum(fx.correlate_frames(start, stop)[0] for start, stop in ((0, 3), (5, 10), (11, N_FRAMES)))
+        self.assertTrue(abs(vis - expected).max() < 1e-9 * abs(expected).max())
+
+        # so the weight only counts the valid frames
+        filename = os.path.join(self.tmp_dir, 'vis.npz')
+        correlator.save_visibilities(filename, ['AA', 'BB'], fx.baselines, arange(NFFT // 2 + 1),
+                                     [self.sources[0].header(0).datetime()], [frames], N_FRAMES, [vis])
+        product = correlator.load_visibilities(filename)
+        self.assertEqual(product['dump_frames'].tolist(), [N_FRAMES - 3])
+        self.assertAlmostEqual(product['weights'][0], (N_FRAMES - 3) / float(N_FRAMES))
+
+    def test_shifted_frames_span_two(self):
+        # shifted by samples, correlated frame n also uses frame n + 1
+        fx = correlator.FXCorrelator(self.sources, [0, 0], NFFT, N_FRAMES, frames_per_batch=8, sample_offsets=[0, 100])
+        (first, frames, vis), = list(fx.dumps())
+        self.assertEqual(len(fx), N_FRAMES - 1)
+        self.assertEqual(frames, N_FRAMES - 1 - 4)
+
+
+class DelaySearchTest(unittest.TestCase):
+
+    DELAY = 37
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        # 16-bit samples well past the int8 range, the second station
+        # DELAY samples ahead of the first and with noise of its own
+        random = RandomState(2)
+        n_samples = N_FRAMES * SAMPLES_PER_FRAME
+        signal = random.normal(0, 6000, n_samples + self.DELAY)
+        self.sources = []
+        for station_id, samples in ((0x4141, signal[:n_samples]), (0x4242, signal[self.DELAY:])):
+            samples = samples + random.normal(0, 3000, n_samples)
+            data = samples.clip(-2**15, 2**15 - 1).astype(int64).reshape(N_FRAMES, SAMPLES_PER_FRAME)
+            filename = os.path.join(self.tmp_dir, '{0:x}.vdif'.format(station_id))
+            write_frames(filename, frame_headers(N_FRAMES, SAMPLES_PER_FRAME, 16, station_id=station_id), data)
+            self.sources.append(VDIFFile(filename))
+
+    def tearDown(self):
+        for source in self.sources:
+            source.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_16bit(self):
+        frame_offsets, sample_offsets, searched = correlator.delay_search(self.sources, [0, 0], 1024, 256)
+        delay, peak = searched[1]
+        self.assertEqual(int(round(delay)), self.DELAY)
+        self.assertTrue(peak > 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
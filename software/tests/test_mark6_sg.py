@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+from struct import pack
+
+from numpy import arange, int64
+
+from vdif import VDIFFrameHeader, frames_to_bin
+from mark6_sg import Mark6SGFile, SG_FILE_HEADER_FMT, SG_SYNC_WORD, SG_PACKET_FORMAT_VDIF
+from tests.vdif_frames import frame_headers
+
+SAMPLES_PER_FRAME = 64
+FRAMES_PER_BLOCK = 4
+N_BLOCKS = 6
+
+
+class Mark6SGFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        n_frames = N_BLOCKS * FRAMES_PER_BLOCK
+        data = (arange(n_frames * SAMPLES_PER_FRAME, dtype=int64) % 4 - 2).reshape(n_frames, SAMPLES_PER_FRAME)
+        frames = bytes(frames_to_bin(frame_headers(n_frames, SAMPLES_PER_FRAME), data))
+        frame_size = len(frames) // n_frames
+        block_size = FRAMES_PER_BLOCK * frame_size
+
+        # version 2 blocks written round-robin to two disks
+        self.filenames = list(os.path.join(self.tmp_dir, 'scan.{0}'.format(n)) for n in range(2))
+        for file_n, filename in enumerate(self.filenames):
+            with open(filename, 'wb') as file_:
+                file_.write(pack(SG_FILE_HEADER_FMT, SG_SYNC_WORD, 2, block_size + 8, SG_PACKET_FORMAT_VDIF, frame_size))
+                for blocknum in range(file_n, N_BLOCKS, 2):
+                    file_.write(pack('<ii', blocknum, block_size + 8))
+                    file_.write(frames[blocknum * block_size:(blocknum + 1) * block_size])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_frames_in_order(self):
+        with Mark6SGFile(self.filenames) as scan:
+            self.assertEqual(len(scan), N_BLOCKS * FRAMES_PER_BLOCK)
+            self.assertEqual(list(scan.headers()['data_frame']), list(range(len(scan))))
+
+    def test_views_outlive_close(self):
+        scan = Mark6SGFile(self.filenames)
+        payloads = scan.payloads(FRAMES_PER_BLOCK, 2 * FRAMES_PER_BLOCK)
+        expected = int(payloads.astype(int64).sum())
+        frame = scan[FRAMES_PER_BLOCK + 1]
+        scan.close()
+        self.assertEqual(int(payloads.astype(int64).sum()), expected)
+        self.assertEqual(VDIFFrameHeader.from_bin(frame).data_frame, FRAMES_PER_BLOCK + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
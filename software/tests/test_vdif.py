@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from numpy import arange, int64
+
+from vdif import VDIFFrameHeader, VDIFFrame, VDIFFile
+from tests.vdif_frames import frame_headers, write_frames
+
+SAMPLES_PER_FRAME = 64
+
+
+class VDIFFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'test.vdif')
+        data = (arange(16 * SAMPLES_PER_FRAME, dtype=int64) % 4 - 2).reshape(16, SAMPLES_PER_FRAME)
+        write_frames(self.filename, frame_headers(16, SAMPLES_PER_FRAME), data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_views_outlive_close(self):
+        vdif_file = VDIFFile(self.filename)
+        payloads = vdif_file.payloads(0, 10)
+        expected = int(payloads.astype(int64).sum())
+        frame = vdif_file[3]
+        vdif_file.close()
+        self.assertEqual(int(payloads.astype(int64).sum()), expected)
+        self.assertEqual(VDIFFrameHeader.from_bin(frame).data_frame, 3)
+
+    def test_close_with_statement(self):
+        with VDIFFile(self.filename) as vdif_file:
+            headers = vdif_file.headers()
+        self.assertEqual(list(headers['data_frame']), list(range(16)))
+
+
+class WideSamplesTest(unittest.TestCase):
+
+    def test_16bit_samples_do_not_wrap(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, 'wide.vdif')
+            data = (arange(2 * SAMPLES_PER_FRAME, dtype=int64) * 683 % 2**16 - 2**15).reshape(2, SAMPLES_PER_FRAME)
+            data[0, 0] = 21600
+            write_frames(filename, frame_headers(2, SAMPLES_PER_FRAME, 16), data)
+            with VDIFFile(filename) as vdif_file:
+                self.assertEqual(vdif_file.samples().tolist(), data.tolist())
+                self.assertEqual(vdif_file.streams()[0].samples().tolist(), data.tolist())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class VDIFFrameTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for bits_per_sample in (2, 8):
+            frame = VDIFFrame()
+            frame.bits_per_sample = bits_per_sample
+            frame.frame_length = (SAMPLES_PER_FRAME * bits_per_sample // 8 + 32) // 8
+            frame.station_id = 0
+            frame.data_frame = 5
+            frame.data = arange(SAMPLES_PER_FRAME) % 2**bits_per_sample - 2**(bits_per_sample - 1)
+            bin_frame = frame.to_bin()
+            self.assertEqual(len(bin_frame), frame.frame_length * 8)
+            copy = VDIFFrame.from_bin(bin_frame)
+            self.assertEqual(copy.data_frame, 5)
+            self.assertEqual(copy.data.tolist(), frame.data.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+from vdif import VDIFFrameHeader, frames_to_bin
+
+
+def frame_headers(n_frames, samples_per_frame, bits_per_sample=2, **fields):
+    """ Return headers of n_frames consecutive frames of station 0
+
+    Other header fields are set from `fields`, to one value for every
+    frame or, given a list or tuple, to one value per frame.
+    """
+
+    hdrs = []
+    for frame_n in range(n_frames):
+        hdr = VDIFFrameHeader()
+        hdr.bits_per_sample = bits_per_sample
+        hdr.frame_length = (samples_per_frame * bits_per_sample // 8 + 32) // 8
+        hdr.station_id = 0
+        hdr.data_frame = frame_n
+        for name, value in fields.items():
+            setattr(hdr, name, value[frame_n] if isinstance(value, (list, tuple)) else value)
+        hdrs.append(hdr)
+    return hdrs
+
+
+def write_frames(filename, hdrs, data):
+    """ Write frames with the given headers and (frames, samples) data to a VDIF file """
+    with open(filename, 'wb') as file_:
+        file_.write(bytes(frames_to_bin(hdrs, data)))
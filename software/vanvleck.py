@@ -0,0 +1,138 @@
+from math import erf
+
+from numpy.fft import rfft, irfft
+from numpy import (
+    inf, pi, arange, array, linspace, concatenate, cumsum, diff, exp, sqrt,
+    sin, cos, where, sign, interp, errstate
+    )
+
+# true correlation coefficients the tables are computed at, as sin(theta)
+# for evenly spaced theta, which crowds points towards 1
+TABLE_POINTS = 512
+
+# threshold-to-sigma ratios the quantized power is tabulated at
+RATIO_GRID = linspace(0.02, 4.0, 1000)
+
+# sample widths the correction is tabulated for (wider ones hardly need it)
+SUPPORTED_BITS = (1, 2, 4)
+
+# cache of quantized power tables, keyed on bits
+_power_tables = {}
+
+
+def thresholds(bits_per_sample, ratio):
+    """ Return the thresholds of a uniform b-bit quantizer in units of sigma """
+    steps = 2**(bits_per_sample - 1) - 1
+    return arange(-steps, steps + 1) * ratio
+
+
+def levels(bits_per_sample):
+    """ Return the quantizer output levels, centered as they are once DC is removed """
+    return arange(2**bits_per_sample) - (2**bits_per_sample - 1) / 2.0
+
+
+def quantized_power(bits_per_sample, ratio):
+    """ Return the output power of a b-bit quantizer fed unit-variance noise """
+    edges = concatenate(([-inf], thresholds(bits_per_sample, ratio), [inf]))
+    cdf = array(list(0.5 * (1 + erf(edge / sqrt(2))) for edge in edges))
+    return (levels(bits_per_sample)**2 * diff(cdf)).sum()
+
+
+def threshold_ratio(bits_per_sample, power):
+    """ Return the threshold-to-sigma ratio that gives a measured output power
+
+    For 1-bit data there is no such ratio (nor a need for one).
+    """
+
+    table = _power_tables.get(bits_per_sample)
+    if table is None:
+        table = array(list(quantized_power(bits_per_sample, ratio) for ratio in RATIO_GRID))
+        _power_tables[bits_per_sample] = table
+
+    # power falls as the thresholds move out
+    return interp(power, table[::-1], RATIO_GRID[::-1])
+
+
+def correlation_table(bits_per_sample, ratio_x, ratio_y, points=TABLE_POINTS):
+    """ Return true and quantized correlation coefficients on [0, 1]
+
+    By Price's theorem the quantized cross-power grows with the true
+    correlation as the sum of the bivariate normal density over all
+    pairs of thresholds. That is integrated in theta, with rho =
+    sin(theta), which removes the singularity at rho = 1, and then
+    normalized by the quantized powers as the correlator does.
+    """
+
+    theta = linspace(0, pi / 2, points)
+    s, c = sin(theta), cos(theta)
+    tx = thresholds(bits_per_sample, ratio_x)[:, None, None]
+    ty = thresholds(bits_per_sample, ratio_y)[None, :, None]
+
+    # density times d(rho)/d(theta), written to stay finite at rho = 1
+    d2 = (tx - ty)**2
+    with errstate(divide='ignore', invalid='ignore'):
+        spread = where(d2 > 0, d2 / (2 * c * c), 0)
+    integrand = exp(-spread - tx * ty / (1 + s)).sum(axis=(0, 1)) / (2 * pi)
+
+    # cumulative trapezoid in theta
+    cross = concatenate(([0], cumsum(0.5 * (integrand[1:] + integrand[:-1]) * diff(theta))))
+    norm = sqrt(quantized_power(bits_per_sample, ratio_x) * quantized_power(bits_per_sample, ratio_y))
+    return s, cross / norm
+
+
+class VanVleckCorrection(object):
+    """ Quantization (Van Vleck) correction of b-bit correlation coefficients
+
+    Threshold-to-sigma ratios are derived from the zero-lag power of the
+    accumulated autos, and a table is computed once for every pair of
+    ratios, rounded to `ratio_step`. Correcting a dump then takes one
+    interpolation per lag.
+    """
+
+    def __init__(self, bits_per_sample, ratio_step=0.01):
+        if bits_per_sample not in SUPPORTED_BITS:
+            raise ValueError('no Van Vleck correction for {0}-bit samples, only {1}'.format(
+                bits_per_sample, ', '.join(str(bits) for bits in SUPPORTED_BITS)))
+        self.bits_per_sample = bits_per_sample
+        self.ratio_step = ratio_step
+        self.tables = {}
+
+    def table(self, ratio_x, ratio_y):
+        key = (int(round(ratio_x / self.ratio_step)), int(round(ratio_y / self.ratio_step)))
+        if key not in self.tables:
+            self.tables[key] = correlation_table(self.bits_per_sample, key[0] * self.ratio_step,
+                                                 key[1] * self.ratio_step)
+        return self.tables[key]
+
+    def correct(self, rho, ratio_x, ratio_y):
+        """ Return the true correlation coefficients behind quantized ones """
+        true, quantized = self.table(ratio_x, ratio_y)
+        return sign(rho) * interp(abs(rho), quantized, true)
+
+    def correct_visibilities(self, vis, baselines, n_samples):
+        """ Correct (baselines, channels) visibilities summed over n_samples samples
+
+        The lags of every baseline are normalized by the zero lags of its
+        autos, corrected and scaled back, so the result keeps the units
+        of the input. Returns the corrected copy and the ratio per input.
+        """
+
+        lags = irfft(vis, axis=-1)
+        zero_lags = dict((left, lags[b, 0]) for b, (left, right) in enumerate(baselines) if left == right)
+        ratios = dict(
+            (n, threshold_ratio(self.bits_per_sample, zero_lag / n_samples) if n_samples else 0.0)
+            for n, zero_lag in zero_lags.items()
+            )
+
+        for b, (left, right) in enumerate(baselines):
+            norm = sqrt(zero_lags[left] * zero_lags[right])
+            if norm > 0:
+                zero_lag = lags[b, 0]
+                lags[b] = self.correct(lags[b] / norm, ratios[left], ratios[right]) * norm
+                if left == right:
+                    lags[b, 0] = zero_lag
+
+        # back to spectra, with DC zeroed as before
+        out = rfft(lags, axis=-1)
+        out[:, 0] = 0
+        return out, ratios
@@ -1,6 +1,89 @@
-from struct import pack, unpack
+from os import fstat, rename
+from mmap import mmap, ACCESS_READ
+from struct import pack, unpack_from, calcsize
 from datetime import datetime, timedelta, tzinfo
-from numpy import int32, uint32, array, zeros
+from numpy import (
+    int8, int16, int32, int64, uint8, array, zeros, empty, asarray, ndarray, ascontiguousarray,
+    arange, frombuffer, take, bincount, memmap, concatenate, diff, flatnonzero,
+    searchsorted, dtype as dtype_
+    )
+
+# time formats accepted by parse_utc
+UTC_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Yy%jd%Hh%Mm%Ss',
+    )
+
+# frames scanned either side of a seek to get past gaps and reordering
+SEEK_WINDOW = 64
+
+# sidecar frame index, written next to the VDIF file by VDIFFile.build_index
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'VDIFIDX2'
+INDEX_BLOCK_FRAMES = 65536
+
+# magic, file size, file mtime, skip bytes, frame size, frame count
+INDEX_HEADER_FMT = '<8sQdQQQ'
+INDEX_HEADER_SIZE = calcsize(INDEX_HEADER_FMT)
+
+# one record per frame in the sidecar index
+INDEX_DTYPE = dtype_([
+    ('offset', '<u8'),
+    ('ref_epoch', 'u1'),
+    ('secs_since_epoch', '<u4'),
+    ('data_frame', '<u4'),
+    ('thread_id', '<u2'),
+    ('station_id', 'S2'),
+    ('invalid_data', bool),
+    ('bits_per_sample', 'u1'),
+    ('eud_vers', 'u1'),
+    ('psn', '<u8'),
+    ])
+
+# ideal 2-bit state occupancy in percent (states 00, 01, 10, 11) for
+# thresholds at +/- 1 sigma, as shown by r2dbe_monitor_nox.py
+IDEAL_2BIT_OCCUPANCY = (15.87, 34.13, 34.13, 15.87)
+
+# cache of byte-to-samples lookup tables, keyed on (bits, dtype)
+_decode_tables = {}
+
+# cache of byte-to-state-counts lookup tables, keyed on bits
+_state_tables = {}
+
+# payload bytes are histogrammed this many at a time for state counts
+STATE_COUNT_BYTES = 256 * 1024
+
+# and this many when counted per group, where every byte gets a wide key
+GROUP_STATE_COUNT_BYTES = 1024 * 1024
+
+# one record per frame header, as returned by headers_from_bin
+HEADER_DTYPE = dtype_([
+    # word 0
+    ('invalid_data', bool),
+    ('legacy_mode', bool),
+    ('secs_since_epoch', '<u4'),
+    # word 1
+    ('ref_epoch', 'u1'),
+    ('data_frame', '<u4'),
+    # word 2
+    ('vdif_vers', 'u1'),
+    ('log2_chans', 'u1'),
+    ('frame_length', '<u4'),
+    # word 3
+    ('complex', bool),
+    ('bits_per_sample', 'u1'),
+    ('thread_id', '<u2'),
+    ('station_id', 'S2'),
+    # words 4-7
+    ('eud_vers', 'u1'),
+    ('eud', '<i8', (4,)),
+    ('psn', '<u8'),
+    ('offset_samp', '<i4'),
+    ('pol', 'u1'),
+    ])
 
 
 class UTC(tzinfo):
@@ -16,6 +99,341 @@ class UTC(tzinfo):
         return timedelta(0)
 
 
+def parse_utc(string):
+    """ Parse a UTC time given as ISO 8601 or VEX, e.g. 2017-04-05T23:10:00 """
+
+    for fmt in UTC_FORMATS:
+        try:
+            return datetime.strptime(string, fmt).replace(tzinfo=UTC())
+        except ValueError:
+            pass
+
+    raise ValueError('unrecognized UTC time {0!r}'.format(string))
+
+
+def decode_table(bits_per_sample, dtype=int8):
+    """ Return a 256-row table mapping a payload byte to its samples """
+
+    key = (bits_per_sample, dtype_(dtype))
+    table = _decode_tables.get(key)
+    if table is None:
+
+        # samples are packed least-significant bits first
+        samp_per_byte = 8 // bits_per_sample
+        samp_max = 2**bits_per_sample - 1
+        bytes_ = arange(256, dtype=int32)
+        table = empty((256, samp_per_byte), dtype)
+        for samp_n in range(samp_per_byte):
+            shift_by = bits_per_sample * samp_n
+            table[:, samp_n] = ((bytes_ >> shift_by) & samp_max) - 2**(bits_per_sample-1)
+
+        _decode_tables[key] = table
+
+    return table
+
+
+def state_table(bits_per_sample):
+    """ Return a 256-row table counting the samples of a byte in each state """
+
+    table = _state_tables.get(bits_per_sample)
+    if table is None:
+
+        # offset-binary state of every sample in every byte
+        states = decode_table(bits_per_sample, int32) + 2**(bits_per_sample-1)
+        table = zeros((256, 2**bits_per_sample), int32)
+        for samp_n in range(states.shape[1]):
+            table[arange(256), states[:, samp_n]] += 1
+
+        _state_tables[bits_per_sample] = table
+
+    return table
+
+
+def state_counts(payload, bits_per_sample):
+    """ Count the samples of a packed payload in each state without unpacking
+
+    Only byte-aligned sample widths are supported. The payload may be
+    any object supporting the buffer interface or a uint8 array of any
+    shape; the counts of states 0 .. 2**bits_per_sample-1 are returned.
+    """
+
+    if isinstance(payload, ndarray) and payload.dtype == uint8:
+        rows = payload.reshape(-1, payload.shape[-1]) if payload.ndim else payload.reshape(1, 1)
+    else:
+        rows = frombuffer(payload, uint8).reshape(1, -1)
+
+    # histogram the bytes a cache-sized piece at a time (bincount widens
+    # its input, so one huge call is several times slower)
+    byte_counts = zeros(256, int64)
+    step = max(1, STATE_COUNT_BYTES // max(1, rows.shape[1]))
+    for row in range(0, len(rows), step):
+        piece = rows[row:row + step].ravel()
+        for start in range(0, len(piece), STATE_COUNT_BYTES):
+            byte_counts += bincount(piece[start:start + STATE_COUNT_BYTES], minlength=256)
+
+    # then turn byte counts into state counts
+    return byte_counts.dot(state_table(bits_per_sample))
+
+
+def group_state_counts(payloads, groups, n_groups, bits_per_sample):
+    """ Count the samples of each group of packed payloads in each state
+
+    Row i of the 2-D uint8 array `payloads` belongs to group groups[i];
+    rows whose group is outside 0 .. n_groups-1 are skipped. The rows
+    are not copied: one bincount on (group, byte) runs a cache-sized
+    piece at a time. An (n_groups, 2**bits_per_sample) array is returned.
+    """
+
+    # key (group, byte) with skipped rows in one extra group
+    keys = asarray(groups, int64).copy()
+    keys[(keys < 0) | (keys >= n_groups)] = n_groups
+    keys <<= 8
+
+    byte_counts = zeros((n_groups + 1) * 256, int64)
+    step = max(1, GROUP_STATE_COUNT_BYTES // max(1, payloads.shape[1]))
+    for row in range(0, len(payloads), step):
+        piece = keys[row:row + step, None] | payloads[row:row + step]
+        byte_counts += bincount(piece.ravel(), minlength=len(byte_counts))
+
+    return byte_counts.reshape(-1, 256)[:n_groups].dot(state_table(bits_per_sample))
+
+
+def sample_dtype(bits_per_sample):
+    """ Return the narrowest signed integer type that holds samples of this width """
+
+    if bits_per_sample <= 8:
+        return dtype_(int8)
+    if bits_per_sample <= 16:
+        return dtype_(int16)
+    return dtype_(int32)
+
+
+def decode_samples(payload, bits_per_sample, out=None, dtype=None):
+    """ Decode the offset-binary samples packed in a VDIF payload
+
+    The payload may be any object supporting the buffer interface
+    (string, mmap) or a uint8 array, in which case payloads run along
+    its last axis. Samples are written into `out` if given, otherwise
+    into a new array of type `dtype` (by default sample_dtype of the
+    width, so wide samples do not wrap).
+    """
+
+    if dtype is None:
+        dtype = sample_dtype(bits_per_sample)
+
+    # view the payload as bytes without copying
+    if isinstance(payload, ndarray) and payload.dtype == uint8:
+        bytes_ = payload
+    else:
+        bytes_ = frombuffer(payload, uint8)
+
+    # byte-aligned widths go through the lookup table
+    if bits_per_sample in (1, 2, 4, 8):
+        table = decode_table(bits_per_sample, dtype if out is None else out.dtype)
+        samp_shape = bytes_.shape + table.shape[1:]
+        if out is None:
+            out = empty(samp_shape[:-2] + (samp_shape[-2] * samp_shape[-1],), table.dtype)
+        # every byte is a valid row, and 'clip' spares take a buffered copy of out
+        take(table, bytes_, axis=0, out=out.reshape(samp_shape), mode='clip')
+        return out
+
+    # otherwise shift the samples out of each 32-bit word
+    words = ascontiguousarray(bytes_).view('<u4')
+    samp_max = 2**bits_per_sample - 1
+    samp_per_word = 32 // bits_per_sample
+    if out is None:
+        out = empty(words.shape[:-1] + (words.shape[-1] * samp_per_word,), dtype)
+    for samp_n in range(samp_per_word):
+        shift_by = bits_per_sample * samp_n
+        samp = ((words >> shift_by) & samp_max).astype('i8')
+        out[..., samp_n::samp_per_word] = samp - 2**(bits_per_sample-1)
+
+    return out
+
+
+def encode_samples(data, bits_per_sample, out=None):
+    """ Pack samples into offset-binary VDIF payload bytes
+
+    Samples run along the last axis of `data`, so a 2-D array encodes
+    one payload per row. The bytes are written into `out` if given,
+    which is either a writable buffer or a uint8 array shaped like
+    `data` with the last axis replaced by the payload size; otherwise
+    a new uint8 array is returned.
+    """
+
+    data = asarray(data)
+
+    # pack byte-aligned widths a byte at a time, others per 32-bit word
+    if bits_per_sample in (1, 2, 4, 8):
+        unit_type, unit_size = uint8, 1
+    else:
+        unit_type, unit_size = '<u4', 4
+    samp_per_unit = (8 * unit_size) // bits_per_sample
+    units_per_row = data.shape[-1] // samp_per_unit
+    row_shape = data.shape[:-1]
+
+    # find where the packed bytes go
+    if out is not None:
+        if isinstance(out, ndarray):
+            dest = out[..., :units_per_row * unit_size]
+        else:
+            dest = frombuffer(out, uint8, data.size // data.shape[-1] * units_per_row * unit_size)
+            dest = dest.reshape(row_shape + (-1,))
+
+    # bytes can be or-ed in place, words are staged first
+    if out is None or unit_size > 1:
+        units = zeros(row_shape + (units_per_row,), unit_type)
+    else:
+        units = dest
+        units[...] = 0
+
+    # reinterpret samples as offset-binary and or them into place
+    samp = data[..., :units_per_row * samp_per_unit].reshape(row_shape + (units_per_row, samp_per_unit))
+    samp_max = 2**bits_per_sample - 1
+    for samp_n in range(samp_per_unit):
+        code = (samp[..., samp_n].astype('i8') + 2**(bits_per_sample-1)) & samp_max
+        shift_by = bits_per_sample * samp_n
+        units |= (code << shift_by).astype(unit_type)
+
+    if out is None:
+        return units.view(uint8)
+    if units is not dest:
+        dest[...] = units.view(uint8)
+    return out
+
+
+def frames_to_bin(headers, data, out=None):
+    """ Pack a block of frames into one contiguous binary buffer
+
+    `headers` holds one VDIFFrameHeader per row of the 2-D sample array
+    `data`. The frames are written into `out` if given (any writable
+    buffer of sufficient size), otherwise into a new bytearray.
+    """
+
+    # all frames in a block share the layout of the first
+    first = headers[0]
+    frame_size = first.frame_length * 8
+    data_start = 16 if first.legacy_mode else 32
+
+    # view the output as one row per frame
+    if out is None:
+        out = bytearray(len(headers) * frame_size)
+    frames = frombuffer(out, uint8, len(headers) * frame_size)
+    frames = frames.reshape(len(headers), frame_size)
+
+    # headers are cheap, pack them one by one
+    for frame_n, header in enumerate(headers):
+        frames[frame_n, :data_start] = frombuffer(VDIFFrameHeader.to_bin(header), uint8)
+
+    # then pack the payloads of all frames together
+    encode_samples(data, first.bits_per_sample, out=frames[:, data_start:])
+
+    return out
+
+
+def headers_from_bin(bin_frames, frame_size=None, count=None, offset=0):
+    """ Parse the headers of consecutive frames into a structured array
+
+    `bin_frames` is any object supporting the buffer interface (string,
+    mmap, numpy array) holding frames of `frame_size` bytes, starting
+    `offset` bytes in. The frame size is taken from the first header if
+    not given. Every field of the returned HEADER_DTYPE array is decoded
+    for all frames at once; trailing partial frames are ignored.
+    """
+
+    # view the buffer as bytes without copying
+    bytes_ = frombuffer(bin_frames, uint8)
+
+    # get the frame size from the first header if needed
+    if frame_size is None:
+        frame_size = 8 * (int(bytes_[offset+8:offset+12].view('<u4')[0]) & 0xffffff)
+
+    # how many whole frames do we have
+    total = max(0, len(bytes_) - offset) // frame_size
+    if count is not None:
+        total = min(total, count)
+
+    # view the eight header words of every frame
+    words = ndarray((total, 8), '<u4', buffer=bytes_, offset=offset, strides=(frame_size, 4))
+    hdrs = zeros(total, HEADER_DTYPE)
+
+    # word 0
+    hdrs['invalid_data'] = (words[:, 0] >> 31) & 0x1
+    hdrs['legacy_mode'] = (words[:, 0] >> 30) & 0x1
+    hdrs['secs_since_epoch'] = words[:, 0] & 0x3fffffff
+
+    # word 1
+    hdrs['ref_epoch'] = (words[:, 1] >> 24) & 0x3f
+    hdrs['data_frame'] = words[:, 1] & 0xffffff
+
+    # word 2
+    hdrs['vdif_vers'] = (words[:, 2] >> 29) & 0x7
+    hdrs['log2_chans'] = (words[:, 2] >> 24) & 0x1f
+    hdrs['frame_length'] = words[:, 2] & 0xffffff
+
+    # word 3
+    hdrs['complex'] = (words[:, 3] >> 31) & 0x1
+    hdrs['bits_per_sample'] = 1 + ((words[:, 3] >> 26) & 0x1f)
+    hdrs['thread_id'] = (words[:, 3] >> 16) & 0x3ff
+    station_id = zeros((total, 2), uint8)
+    station_id[:, 0] = (words[:, 3] >> 8) & 0xff
+    station_id[:, 1] = words[:, 3] & 0xff
+    hdrs['station_id'] = station_id.view('S2')[:, 0]
+
+    # words 4-7
+    hdrs['eud_vers'] = (words[:, 4] >> 24) & 0xff
+    hdrs['eud'][:, 0] = words[:, 4] & 0xffffff
+    hdrs['pol'] = words[:, 4] & 0x1
+    hdrs['eud'][:, 1] = words[:, 5].view('<i4')
+    hdrs['eud'][:, 2] = words[:, 6]
+    hdrs['eud'][:, 3] = words[:, 7]
+    hdrs['psn'] = words[:, 6] + (words[:, 7].astype('<u8') << 32)
+    hdrs['offset_samp'] = words[:, 5].view('<i4')
+
+    # legacy frames have no extended user data
+    legacy = hdrs['legacy_mode']
+    if legacy.any():
+        for name in ('eud_vers', 'eud', 'pol', 'psn', 'offset_samp'):
+            hdrs[name][legacy] = 0
+
+    return hdrs
+
+
+def stream_runs(indices):
+    """ Split increasing frame numbers into (first, step, count) evenly spaced runs
+
+    Interleaved threads give one run per stream, so each run can be
+    read as a single strided view of the file.
+    """
+
+    runs = []
+    steps = diff(indices)
+    changes = flatnonzero(diff(steps)) + 1
+    start = 0
+    while start < len(indices):
+
+        # the run goes on until the step changes
+        if start + 1 < len(indices):
+            change_n = searchsorted(changes, start, 'right')
+            stop = changes[change_n] if change_n < len(changes) else len(steps)
+            step = int(steps[start])
+        else:
+            stop, step = start, 1
+
+        runs.append((int(indices[start]), step, int(stop - start + 1)))
+        start = stop + 1
+
+    return runs
+
+
+def run_indices(runs):
+    """ Expand (first, step, count) runs, as from stream_runs, back into frame numbers """
+
+    if not runs:
+        return zeros(0, int64)
+    return concatenate(list(arange(first, first + step * count, step) for first, step, count in runs))
+
+
 class VDIFFrameHeader(object):
 
     def __init__(self, sample_rate=4096e6):
@@ -55,7 +473,7 @@ class VDIFFrameHeader(object):
         inst = cls()
 
         # parse bin data
-        words = list(unpack('<4I', bin_hdr[0:16]))
+        words = list(unpack_from('<4I', bin_hdr, 0))
 
         # word 0
         inst.invalid_data = bool((words[0] >> 31) & 0x1)
@@ -80,9 +498,9 @@ class VDIFFrameHeader(object):
         if not inst.legacy_mode:
 
             # parse extended user data
-            words.extend(unpack('<I', bin_hdr[16:20]))
-            words.extend(unpack('<i', bin_hdr[20:24]))
-            words.extend(unpack('<2I', bin_hdr[24:32]))
+            words.extend(unpack_from('<I', bin_hdr, 16))
+            words.extend(unpack_from('<i', bin_hdr, 20))
+            words.extend(unpack_from('<2I', bin_hdr, 24))
 
             # words 4-7
             inst.eud_vers = (words[4] >> 24) & 0xff
@@ -143,22 +561,27 @@ class VDIFFrameHeader(object):
     def __str__(self):
         return self.to_bin()
 
-    def datetime(self, end=False):
+    def frame_period(self):
 
         # find out how many words per frame
         header_size = 2 if self.legacy_mode else 4
         data_words = 2 * (self.frame_length - header_size)
 
         # now how many time samples per frame
-        samp_per_word = 32 / self.bits_per_sample
-        tsamp_per_word = samp_per_word / (int(self.complex) + 1)
+        samp_per_word = 32 // self.bits_per_sample
+        tsamp_per_word = samp_per_word // (int(self.complex) + 1)
         tsamp_per_frame = tsamp_per_word * data_words
 
+        # now how many secs per frame
+        return tsamp_per_frame / self.sample_rate
+
+    def datetime(self, end=False):
+
         # now how many usecs per frame
-        usecs_per_frame = 1e6 * (tsamp_per_frame / self.sample_rate)
+        usecs_per_frame = 1e6 * self.frame_period()
 
         # get the date
-        date = datetime(year = 2000 + self.ref_epoch/2,
+        date = datetime(year = 2000 + self.ref_epoch//2,
                         month = 1 + (self.ref_epoch & 1) * 6,
                         day = 1, tzinfo=UTC())
 
@@ -188,25 +611,10 @@ class VDIFFrame(VDIFFrameHeader):
         data_start = 16 if inst.legacy_mode else 32
         data_stop = inst.frame_length * 8
         data_size = data_stop - data_start
-        data_words = data_size / 4
-
-        # create empty data buffer
-        samp_per_word = 32 / inst.bits_per_sample
-        inst.data = zeros(samp_per_word * data_words, int32)
 
-        # unpack data into array
-        words = array(unpack('<{0}I'.format(data_words), bin_frame[data_start:data_stop]), uint32)
-
-        # interpret the data given our bits-per-sample
-        samp_max = 2**inst.bits_per_sample - 1
-        for samp_n in range(samp_per_word):
-
-            # get sample data from words
-            shift_by = inst.bits_per_sample * samp_n
-            inst.data[samp_n::samp_per_word] = (words >> shift_by) & samp_max
-
-        # we need to reinterpret as offset binary
-        inst.data = inst.data - 2**(inst.bits_per_sample-1)
+        # decode the offset-binary samples straight from the payload
+        payload = frombuffer(bin_frame, uint8, data_size, data_start)
+        inst.data = decode_samples(payload, inst.bits_per_sample, dtype=int32)
 
         return inst
 
@@ -219,27 +627,340 @@ class VDIFFrame(VDIFFrameHeader):
         data_start = 16 if self.legacy_mode else 32
         data_stop = self.frame_length * 8
         data_size = data_stop - data_start
-        data_words = data_size / 4
+        data_words = data_size // 4
 
-        # reinterpet data given our bits-per-sample
-        samp_max = 2**self.bits_per_sample - 1
-        samp_per_word = 32 / self.bits_per_sample
-        for word_n in range(data_words):
-            word = 0
+        # pack the samples given our bits-per-sample
+        samp_per_word = 32 // self.bits_per_sample
+        data = self.data[:data_words * samp_per_word]
+        out_str += encode_samples(data, self.bits_per_sample).tobytes()
+
+        return out_str
 
-            for samp_n in range(samp_per_word):
-                samp = int(self.data[word_n * samp_per_word + samp_n])
+    def __str__(self):
+        return self.to_bin()
 
-                # reinterpret sample as offset-binary
-                samp = (samp + 2**(self.bits_per_sample-1)) & samp_max
 
-                # add the sample data to the word
-                shift_by = self.bits_per_sample * samp_n
-                word = word + (samp << shift_by)
+class VDIFStream(object):
+    """ The frames of one thread of one station in a VDIFFile
 
-            out_str += pack('<I', word)
+    `indices` are the frame numbers of the stream in file order. Stream
+    frame n is file frame indices[n], and payloads come out as views of
+    the file, one per evenly spaced run of frames (see stream_runs).
+    """
 
-        return out_str
+    def __init__(self, vdif_file, thread_id, station_id, indices):
+        self.vdif_file = vdif_file
+        self.thread_id = thread_id
+        self.station_id = station_id
+        self.indices = indices
 
-    def __str__(self):
-        return self.to_bin()
+    def __len__(self):
+        return len(self.indices)
+
+    def __repr__(self):
+        return '<VDIFStream thread {0} station {1!r}: {2} frames>'.format(
+            self.thread_id, pack('>H', self.station_id), len(self))
+
+    def header(self, frame_n):
+        return self.vdif_file.header(self.indices[frame_n])
+
+    def frame(self, frame_n):
+        return self.vdif_file.frame(self.indices[frame_n])
+
+    def runs(self, start=None, stop=None, max_frames=INDEX_BLOCK_FRAMES):
+        """ Return (first, step, count) runs covering stream frames [start, stop) """
+
+        start, stop, _ = slice(start, stop).indices(len(self))
+        runs = []
+        for first, step, count in stream_runs(self.indices[start:stop]):
+            for n in range(0, count, max_frames):
+                runs.append((first + n * step, step, min(max_frames, count - n)))
+        return runs
+
+    def headers(self, start=None, stop=None):
+        """ Return the headers of stream frames [start, stop) as a structured array """
+
+        hdrs = empty(0, HEADER_DTYPE)
+        blocks = list(
+            self.vdif_file.headers(first, first + step * (count - 1) + 1)[::step]
+            for first, step, count in self.runs(start, stop)
+            )
+        return concatenate(blocks) if blocks else hdrs
+
+    def payload_blocks(self, start=None, stop=None, max_frames=INDEX_BLOCK_FRAMES):
+        """ Yield 2-D payload views of stream frames [start, stop), at most max_frames at a time """
+
+        for first, step, count in self.runs(start, stop, max_frames):
+            yield self.vdif_file.payloads(first, first + step * (count - 1) + 1, step)
+
+    def header_word_blocks(self, start=None, stop=None, max_frames=INDEX_BLOCK_FRAMES):
+        """ Yield 2-D header word views of stream frames [start, stop), at most max_frames at a time """
+
+        for first, step, count in self.runs(start, stop, max_frames):
+            yield self.vdif_file.header_words(first, first + step * (count - 1) + 1, step)
+
+    def sample_blocks(self, start=None, stop=None, max_frames=INDEX_BLOCK_FRAMES, dtype=None):
+        """ Yield decoded samples of stream frames [start, stop), one row per frame """
+
+        bits_per_sample = self.header(0).bits_per_sample
+        for payloads in self.payload_blocks(start, stop, max_frames):
+            yield decode_samples(payloads, bits_per_sample, dtype=dtype)
+
+    def samples(self, start=None, stop=None, out=None, dtype=None):
+        """ Decode the samples of stream frames [start, stop), one row per frame
+
+        Samples are of type `dtype`, by default the sample_dtype of the width.
+        """
+
+        bits_per_sample = self.header(0).bits_per_sample
+        runs = self.runs(start, stop)
+        if out is None:
+            samples_per_frame = (self.vdif_file.frame_size - self.vdif_file.header_size) * 8 // bits_per_sample
+            out = empty((sum(count for _, _, count in runs), samples_per_frame),
+                        sample_dtype(bits_per_sample) if dtype is None else dtype)
+
+        # decode every run straight into its rows of the output
+        row = 0
+        for first, step, count in runs:
+            payloads = self.vdif_file.payloads(first, first + step * (count - 1) + 1, step)
+            decode_samples(payloads, bits_per_sample, out[row:row + count])
+            row += count
+
+        return out
+
+
+class VDIFFile(object):
+    """ Memory-mapped VDIF file with random access by frame number
+
+    Indexing and slicing return uint8 views of whole frames straight
+    from the mapping; the first `skip_bytes` of the file are ignored, as
+    is a trailing partial frame. Views stay valid after close, which
+    only releases the mapping once the last of them is gone.
+
+    If an up-to-date sidecar index exists (see build_index) it is mapped
+    as `index` and used for time seeks, otherwise `index` is None.
+    """
+
+    def __init__(self, filename, skip_bytes=0, frame_size=None, sample_rate=4096e6, use_index=True):
+        self.filename = filename
+        self.skip_bytes = skip_bytes
+        self.sample_rate = sample_rate
+
+        # map the whole file read-only
+        self._file = open(filename, 'rb')
+        file_size = fstat(self._file.fileno()).st_size
+        if file_size > 0:
+            self._mmap = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+            self._bytes = frombuffer(self._mmap, uint8)
+        else:
+            self._mmap = None
+            self._bytes = zeros(0, uint8)
+        data_size = max(0, file_size - skip_bytes)
+
+        # get the frame layout from the first header
+        if data_size >= 32:
+            first_hdr = VDIFFrameHeader.from_bin(self._bytes[skip_bytes:])
+            self.header_size = 16 if first_hdr.legacy_mode else 32
+            if frame_size is None:
+                frame_size = first_hdr.frame_length * 8
+        else:
+            self.header_size = 32
+        if not frame_size:
+            self.close()
+            raise ValueError('no VDIF frame found in {0}'.format(filename))
+        self.frame_size = frame_size
+
+        # view all whole frames, leaving any partial one out
+        total = data_size // frame_size
+        self.trailing_bytes = data_size - total * frame_size
+        stop = skip_bytes + total * frame_size
+        self.frames = self._bytes[skip_bytes:stop].reshape(total, frame_size)
+
+        # pick up the sidecar index if there is one
+        self.index_filename = filename + INDEX_SUFFIX
+        self.index = self.load_index() if use_index else None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, key):
+        return self.frames[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def _range(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return start, max(start, stop)
+
+    def header(self, frame_n):
+        inst = VDIFFrameHeader.from_bin(self[frame_n])
+        inst.sample_rate = self.sample_rate
+        return inst
+
+    def frame(self, frame_n):
+        inst = VDIFFrame.from_bin(self[frame_n])
+        inst.sample_rate = self.sample_rate
+        return inst
+
+    def frame_datetime(self, frame_n):
+        """ Return the start time of a frame, from the index if there is one """
+
+        if self.index is None:
+            return self.header(frame_n).datetime()
+
+        # the index only holds timing, take the frame layout from the file
+        record = self.index[frame_n]
+        inst = self.header(0)
+        inst.ref_epoch = int(record['ref_epoch'])
+        inst.secs_since_epoch = int(record['secs_since_epoch'])
+        inst.data_frame = int(record['data_frame'])
+        return inst.datetime()
+
+    def seek_time(self, when, window=SEEK_WINDOW):
+        """ Return the number of the first frame at or after time `when`
+
+        Bisects on the header timestamps, so takes O(log N) header reads,
+        then scans `window` frames either side of the result so that
+        gaps and locally reordered frames cannot push it past data at
+        or after `when`. Returns len(self) if all frames are earlier.
+        """
+
+        # naive times are taken to be UTC
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=UTC())
+
+        # bisect assuming time increases with frame number
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.frame_datetime(mid) < when:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # then settle on the earliest such frame nearby
+        start, stop = max(0, lo - window), min(len(self), lo + window)
+        for frame_n in range(start, stop):
+            if self.frame_datetime(frame_n) >= when:
+                return min(frame_n, lo)
+
+        return lo
+
+    def headers(self, start=None, stop=None):
+        """ Return the headers of frames [start, stop) as a structured array """
+        start, stop = self._range(start, stop)
+        offset = self.skip_bytes + start * self.frame_size
+        return headers_from_bin(self._bytes, self.frame_size, stop - start, offset)
+
+    def header_words(self, start=None, stop=None, step=1):
+        """ Return a 2-D uint32 view of the header words of frames [start, stop), every step-th frame """
+        start, stop = self._range(start, stop)
+        return ndarray((-(-(stop - start) // step), self.header_size // 4), '<u4', buffer=self._bytes,
+                       offset=self.skip_bytes + start * self.frame_size, strides=(step * self.frame_size, 4))
+
+    def payloads(self, start=None, stop=None, step=1):
+        """ Return a 2-D view of the payloads of frames [start, stop), every step-th frame """
+        start, stop = self._range(start, stop)
+        return self.frames[start:stop:step, self.header_size:]
+
+    def samples(self, start=None, stop=None, out=None, dtype=None):
+        """ Decode the samples of frames [start, stop), one row per frame, by default as sample_dtype """
+        bits_per_sample = self.header(0).bits_per_sample
+        return decode_samples(self.payloads(start, stop), bits_per_sample, out, dtype)
+
+    def streams(self, start=None, stop=None, block_frames=INDEX_BLOCK_FRAMES):
+        """ Demultiplex frames [start, stop) into a VDIFStream per thread and station
+
+        The streams are classified in one vectorized pass over the index,
+        if there is one, or over the headers a block at a time. They are
+        returned ordered by station and then thread.
+        """
+
+        start, stop = self._range(start, stop)
+
+        # one key per frame with station in the top and thread in the low bits
+        keys = empty(stop - start, int64)
+        for block_start in range(start, stop, block_frames):
+            block_stop = min(block_start + block_frames, stop)
+            if self.index is not None:
+                hdrs = self.index[block_start:block_stop]
+            else:
+                hdrs = self.headers(block_start, block_stop)
+            station_id = ascontiguousarray(hdrs['station_id']).view('>u2').astype(int64)
+            keys[block_start - start:block_stop - start] = (station_id << 16) | hdrs['thread_id']
+
+        # a stable sort keeps every stream in file order
+        order = keys.argsort(kind='mergesort')
+        bounds = concatenate(([0], flatnonzero(diff(keys[order])) + 1, [len(keys)]))
+        streams = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if lo < hi:
+                key = int(keys[order[lo]])
+                streams.append(VDIFStream(self, key & 0xffff, key >> 16, order[lo:hi] + start))
+
+        return streams
+
+    def build_index(self, block_frames=INDEX_BLOCK_FRAMES):
+        """ Write the sidecar index for this file and start using it """
+
+        # the index is only valid for this exact file
+        stat = fstat(self._file.fileno())
+        index_header = pack(INDEX_HEADER_FMT, INDEX_MAGIC, stat.st_size, stat.st_mtime,
+                            self.skip_bytes, self.frame_size, len(self))
+
+        # write to a temporary file so readers never see a partial index
+        tmp_filename = self.index_filename + '.tmp'
+        records = zeros(block_frames, INDEX_DTYPE)
+        with open(tmp_filename, 'wb') as file_:
+            file_.write(index_header)
+            for start in range(0, len(self), block_frames):
+                hdrs = self.headers(start, start + block_frames)
+                block = records[:len(hdrs)]
+                block['offset'] = self.skip_bytes + self.frame_size * arange(start, start + len(hdrs))
+                for name in INDEX_DTYPE.names[1:]:
+                    block[name] = hdrs[name]
+                file_.write(block.tobytes())
+        rename(tmp_filename, self.index_filename)
+
+        self.index = self.load_index()
+        return self.index
+
+    def load_index(self):
+        """ Map the sidecar index, or return None if missing or stale """
+
+        try:
+            with open(self.index_filename, 'rb') as file_:
+                index_header = file_.read(INDEX_HEADER_SIZE)
+                index_size = fstat(file_.fileno()).st_size
+        except (IOError, OSError):
+            return None
+
+        # the index is stale if this file has changed since it was built
+        if not len(index_header) == INDEX_HEADER_SIZE:
+            return None
+        magic, file_size, mtime, skip_bytes, frame_size, count = unpack_from(INDEX_HEADER_FMT, index_header)
+        stat = fstat(self._file.fileno())
+        if not (magic == INDEX_MAGIC and file_size == stat.st_size and mtime == stat.st_mtime and
+                skip_bytes == self.skip_bytes and frame_size == self.frame_size and count == len(self) and
+                index_size == INDEX_HEADER_SIZE + count * INDEX_DTYPE.itemsize):
+            return None
+
+        # an empty array cannot be mapped
+        if count == 0:
+            return zeros(0, INDEX_DTYPE)
+
+        return memmap(self.index_filename, INDEX_DTYPE, 'r', INDEX_HEADER_SIZE, (count,))
+
+    def close(self):
+        self.index = None
+        self.frames = self._bytes = None
+
+        # views handed out (e.g. payloads) hold on to the map, which is
+        # unmapped once the last of them is gone; closing it here would
+        # leave them pointing at unmapped memory (python2 has no check)
+        self._mmap = None
+        self._file.close()
@@ -1,163 +1,449 @@
-import sys
+import json
+import pickle
 import logging
 import argparse
-from datetime import datetime
+from os import rename
+from copy import deepcopy
+from multiprocessing import Pool
+from datetime import datetime, timedelta
 from itertools import combinations
 
 import pylab
 from numpy.fft import fftshift, rfft, irfft
+from numpy.random import RandomState
 from numpy import (
     pi, log10, angle, sqrt, real, conjugate, 
-    split, arange, zeros_like
+    split, arange, zeros_like, linspace, unique, generic, ndarray
     )
 
 import checks
-from vdif import VDIFFrameHeader, VDIFFrame
-
-# parse the user's command line arguments
-parser = argparse.ArgumentParser(description='check a VDIF file for header/data quality')
-parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
-parser.add_argument('-t', '--time', dest='tc_only', action='store_true', help='do the time-check only')
-parser.add_argument('-s', '--skip-bytes', metavar="SKIP_BYTES", dest='skip_bytes', type=int, default=0,
-                    help='if given the script will ignore the first SKIP_BYTES of file')
-parser.add_argument('-n', '--frames-to-check', dest='frames_to_check', default=-1, 
-                    type=int, help='number of frames (from the beginning) to check (default: all)')
-parser.add_argument('filename', type=str, help='VDIF filename to check for quality')
-args = parser.parse_args()
-
-# create logger object
+from vdif import parse_utc, INDEX_DTYPE
+from mark6_sg import open_recording
+
+# number of headers parsed and checked at once
+HEADERS_PER_BATCH = 65536
+
+# check state for incremental runs is kept next to the JSON report
+STATE_SUFFIX = '.state'
+
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
-
-# set up the logging handler
-handler = logging.StreamHandler()
-quiet = logging.Formatter(fmt='%(message)s')
-verbose = logging.Formatter(fmt='%(name)s - %(message)s')
-handler.setFormatter(verbose if args.verbose else quiet)
-
-# add handler to logger
-logger.addHandler(handler)
-
-# find current ref. epocj
-today = datetime.today()
-this_epoch = 2 * (today.year - 2000) + (today.month / 6)
-logger.debug('current ref. epoch: {0}'.format(this_epoch))
-
-# error-type checks
-error_checks = (
-    checks.CountNotEqualTo('non-null VDIF vers', 'vdif_vers', 0),
-    checks.CountEqualTo('legacy mode frames', 'legacy_mode', True),
-    checks.CountEqualTo('invalid data frames', 'invalid_data', True),
-    checks.CountOutOfRange('out-of-range log2(chans)', 'log2_chans', 0, 31),
-    checks.CountOutOfRange('out-of-range length', 'frame_length', 1, 2**23),
-    checks.CountOutOfRange('invalid ref. epochs', 'ref_epoch', 0, this_epoch),
-    checks.CountOutOfRange('out-of-range secs since epoch', 'secs_since_epoch', 0, 6*31*24*3600),
-    checks.CountNotIncrementingBy('out-of-order frames', 'data_frame', 1),
-    )
 
-# sanity-type checks
-sanity_checks = (
-    checks.CountEqualTo('real-data frames', 'complex', False),
-    checks.CountEqualTo('complex-data frames', 'complex', True),
-    checks.ListingCheck('unique thread IDs found', 'thread_id'),
-    checks.ListingCheck('unique station IDs found', 'station_id'),
-    checks.ListingCheck('unique sample bitwidths found', 'bits_per_sample'),
-    checks.ListingCheck('EDV versions found', 'eud_vers'),
-    checks.CountNotEqualTo('Non-zero EUDs', 'eud', [0, 0, 0, 0]),
-    )
+def jsonable(value):
+    """ Turn check results (numpy values, byte strings, tuples) into JSON types """
+
+    if isinstance(value, dict):
+        return dict((str(k), jsonable(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return list(jsonable(v) for v in value)
+    if isinstance(value, ndarray):
+        return jsonable(value.tolist())
+    if isinstance(value, generic):
+        return jsonable(value.item())
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('latin-1')
+    return value
+
+def write_atomic(filename, data):
+    """ Write data to filename so readers never see a partial file """
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as file_:
+        file_.write(data)
+    rename(tmp_filename, filename)
+
+def load_state(filename, vdif_file, payload, index_only):
+    """ Load the check state of a previous run over the start of this file
+
+    Returns None if there is no usable state, e.g. the file was replaced
+    or truncated, or it was checked with different options.
+    """
+
+    try:
+        with open(filename, 'rb') as file_:
+            state = pickle.load(file_)
+    except (IOError, OSError):
+        logger.info('no previous state in {0}, checking the whole file'.format(filename))
+        return None
+
+    first_header = vdif_file[0][:vdif_file.header_size].tobytes() if len(vdif_file) else b''
+    if (state['filename'] != vdif_file.filename or state['skip_bytes'] != vdif_file.skip_bytes or
+            state['frame_size'] != vdif_file.frame_size or state['first_header'] != first_header or
+            state['stop_frame'] > len(vdif_file) or state['payload'] != payload or
+            state.get('index_only') != index_only):
+        logger.warning('previous state in {0} does not match, checking the whole file'.format(filename))
+        return None
+
+    return state
+
+def check_frames(chunk):
+    """ Run the given checks over frames [start, stop) of a VDIF file
+
+    With `index_only`, the checks get the records of the sidecar index
+    instead of the parsed headers, as long as it is still up to date.
+    """
+
+    filename, skip_bytes, mark6, index_only, start, stop, all_checks = chunk
+    if start >= stop:
+        return all_checks
+
+    with open_recording(filename, mark6, skip_bytes) as vdif_file:
+
+        # go through the frames a batch at a time
+        for batch_start in range(start, stop, HEADERS_PER_BATCH):
+
+            # parse all headers in the batch straight from the mapped file,
+            # or just read their index records
+            batch_stop = min(batch_start + HEADERS_PER_BATCH, stop)
+            if index_only and vdif_file.index is not None:
+                headers = vdif_file.index[batch_start:batch_stop]
+            else:
+                headers = vdif_file.headers(batch_start, batch_stop)
+
+            # payload checks also get the packed payloads, as views of the file
+            payloads = None
+            if any(check.needs_payload for check in all_checks):
+                payloads = vdif_file.payloads(batch_start, batch_start + len(headers))
+
+            # every check runs over the whole batch at once
+            for check in all_checks:
+                if check.needs_payload:
+                    check(headers, payloads)
+                else:
+                    check(headers)
+
+            # every so often tell user we're still alive
+            logger.debug('still alive! currently on frame {0}'.format(batch_start + len(headers)))
+
+    return all_checks
+
+def main():
+    """ Check the quality of the VDIF file named on the command line """
+
+    # parse the user's command line arguments
+    parser = argparse.ArgumentParser(description='check a VDIF file for header/data quality')
+    parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
+    parser.add_argument('-t', '--time', dest='tc_only', action='store_true', help='do the time-check only')
+    parser.add_argument('-s', '--skip-bytes', metavar="SKIP_BYTES", dest='skip_bytes', type=int, default=0,
+                        help='if given the script will ignore the first SKIP_BYTES of file')
+    parser.add_argument('-n', '--frames-to-check', dest='frames_to_check', default=-1, 
+                        type=int, help='number of frames (from the beginning) to check (default: all)')
+    parser.add_argument('--start', dest='start', metavar='UTC', type=parse_utc, default=None,
+                        help='skip ahead to the first frame at or after UTC (e.g. 2017-04-05T23:10:00 or 2017y095d23h10m00s)')
+    parser.add_argument('--duration', dest='duration', metavar='SECS', type=float, default=None,
+                        help='check only SECS seconds of data from the start (default: to end of file)')
+    parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=1,
+                        help='split the frames into N chunks checked in parallel processes (default: 1)')
+    parser.add_argument('--sample', dest='sample', metavar='K', type=int, default=0,
+                        help='only check K windows of frames spread across the file and estimate error rates (default: check all)')
+    parser.add_argument('--window', dest='window', metavar='W', type=int, default=1024,
+                        help='number of frames in each sampled window (default: 1024)')
+    parser.add_argument('--random', dest='random', action='store_true',
+                        help='place sampled windows at random instead of evenly spaced')
+    parser.add_argument('--seed', dest='seed', type=int, default=None,
+                        help='seed for randomly placed windows (default: unseeded)')
+    parser.add_argument('--sample-rate', dest='sample_rate', default=4096.0, type=float,
+                        help='rate at which the data was sampled in MHz (default: 4096.0)')
+    parser.add_argument('--max-gaps', dest='max_gaps', metavar='N', type=int, default=50,
+                        help='list at most N entries of the frame continuity gap map (default: 50)')
+    parser.add_argument('--payload', dest='payload', action='store_true',
+                        help='also histogram 2-bit sample states per thread and second (reads all data)')
+    parser.add_argument('--tolerance', dest='tolerance', metavar='PCT', type=float, default=5.0,
+                        help='flag seconds where any 2-bit state is off its ideal share by more than PCT %% (default: 5.0)')
+    parser.add_argument('--index-only', dest='index_only', action='store_true',
+                        help='only run the checks of header fields the frame index keeps (see vdif_index.py), '
+                        'reading it instead of the headers while it is up to date')
+    parser.add_argument('--mark6', dest='mark6', action='store_true',
+                        help='filename is a Mark6 scan name (or glob of its scatter-gather files) read in place')
+    parser.add_argument('--json', dest='json', metavar='REPORT', type=str, default=None,
+                        help='also write the results and gap map to REPORT as JSON')
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='only check frames added since the last run that wrote REPORT, and merge them in')
+    parser.add_argument('filename', type=str, help='VDIF filename to check for quality')
+    args = parser.parse_args()
+
+    # show debugging logs if asked to
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    # set up the logging handler
+    handler = logging.StreamHandler()
+    quiet = logging.Formatter(fmt='%(message)s')
+    verbose = logging.Formatter(fmt='%(name)s - %(message)s')
+    handler.setFormatter(verbose if args.verbose else quiet)
+
+    # add handler to logger
+    logger.addHandler(handler)
+
+    # an incremental run always covers the whole file
+    if args.incremental:
+        if args.json is None:
+            err_msg = '--incremental needs a --json report to keep its state next to'
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+        if args.start is not None or args.duration is not None or args.frames_to_check > 0 or args.sample > 0:
+            err_msg = '--incremental cannot be combined with --start, --duration, -n or --sample'
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+
+    # find current ref. epocj
+    today = datetime.today()
+    this_epoch = 2 * (today.year - 2000) + (today.month / 6)
+    logger.debug('current ref. epoch: {0}'.format(this_epoch))
+
+    # error-type checks
+    error_checks = (
+        checks.CountNotEqualTo('non-null VDIF vers', 'vdif_vers', 0),
+        checks.CountEqualTo('legacy mode frames', 'legacy_mode', True),
+        checks.CountEqualTo('invalid data frames', 'invalid_data', True),
+        checks.CountOutOfRange('out-of-range log2(chans)', 'log2_chans', 0, 31),
+        checks.CountOutOfRange('out-of-range length', 'frame_length', 1, 2**23),
+        checks.CountOutOfRange('invalid ref. epochs', 'ref_epoch', 0, this_epoch),
+        checks.CountOutOfRange('out-of-range secs since epoch', 'secs_since_epoch', 0, 6*31*24*3600),
+        checks.CountNotIncrementingBy('out-of-order frames', 'data_frame', 1),
+        )
+
+    # sanity-type checks
+    sanity_checks = (
+        checks.CountEqualTo('real-data frames', 'complex', False),
+        checks.CountEqualTo('complex-data frames', 'complex', True),
+        checks.ListingCheck('unique thread IDs found', 'thread_id'),
+        checks.ListingCheck('unique station IDs found', 'station_id'),
+        checks.ListingCheck('unique sample bitwidths found', 'bits_per_sample'),
+        checks.ListingCheck('EDV versions found', 'eud_vers'),
+        checks.CountNotEqualTo('Non-zero EUDs', 'eud', [0, 0, 0, 0]),
+        )
+
+    # open the VDIF file
+    logger.debug('opening: {0}'.format(args.filename))
+    with open_recording(args.filename, args.mark6, args.skip_bytes, args.sample_rate*1e6) as vdif_file:
+
+        # get the first VDIF header
+        first_hdr = vdif_file.header(0)
+        logger.debug('first header: {0}'.format(repr(first_hdr)))
+
+        # determine the packet size
+        pkt_size = vdif_file.frame_size
+        logger.debug('packet size: {0} bytes'.format(pkt_size))
+
+        # is pkt_size possbily too big?
+        if pkt_size > 8224:
+            logger.warning('packet size possibly too big. check start byte offset')
+
+        # the sidecar index (see vdif_index.py) makes time seeks cheap, and
+        # saves parsing the headers for the index-only checks; a stale one
+        # (e.g. of a growing file) is ignored, and the headers parsed instead
+        if vdif_file.index is not None:
+            logger.debug('using frame index: {0}'.format(vdif_file.index_filename))
+        elif args.index_only:
+            logger.warning('no up-to-date frame index, parsing the headers for the index-only checks')
+
+        # does the file end in a partial frame?
+        if vdif_file.trailing_bytes:
+            logger.warning('ignoring {0} trailing bytes of partial frame'.format(vdif_file.trailing_bytes))
+
+        # get the last VDIF header
+        last_hdr = vdif_file.header(-1)
+        logger.debug('last header: {0}'.format(repr(last_hdr)))
+
+        # get start, stop, and total time
+        start = first_hdr.datetime()
+        stop  = last_hdr.datetime(end=True)
+        total = stop - start
+
+        # print out time-check info
+        logger.info('\nprint time-check information...')
+        logger.info('start time: {0:%d %b %Y %Z %X.%f}'.format(start))
+        logger.info('stop  time: {0:%d %b %Y %Z %X.%f}'.format(stop))
+        logger.info('total time: {0:f} secs'.format(total.seconds + total.microseconds * 1e-6))
+
+        # machine-readable version of everything printed
+        report = dict(
+            filename=args.filename, skip_bytes=args.skip_bytes, frame_size=pkt_size, frames=len(vdif_file),
+            start_time='{0:%Y-%m-%dT%H:%M:%S.%f}'.format(start), stop_time='{0:%Y-%m-%dT%H:%M:%S.%f}'.format(stop),
+            total_secs=total.days * 86400 + total.seconds + total.microseconds * 1e-6,
+            )
+
+        # exit if user wants only time check
+        if args.tc_only:
+            if args.json is not None:
+                write_atomic(args.json, json.dumps(report, indent=2, sort_keys=True).encode('ascii'))
+            return
+
+        # seek to the requested time range
+        start_frame, stop_frame = 0, len(vdif_file)
+        if args.start is not None:
+            start_frame = vdif_file.seek_time(args.start)
+            logger.info('seeking to frame {0} for start time {1:%d %b %Y %Z %X.%f}'.format(start_frame, args.start))
+        if args.duration is not None:
+            range_start = args.start if args.start is not None else start
+            stop_frame = vdif_file.seek_time(range_start + timedelta(seconds=args.duration))
+            logger.info('stopping before frame {0} after {1:f} secs'.format(stop_frame, args.duration))
+
+        # frame continuity is checked per stream, wrapping data_frame at
+        # the number of frames per second
+        frames_per_second = int(round(1.0 / first_hdr.frame_period()))
+        continuity = checks.ContinuityCheck('lost/duplicate/reordered frames', frames_per_second)
+        error_checks = error_checks + (continuity,)
+
+        # optionally compare 2-bit state occupancy against the ideal split
+        occupancy = None
+        if args.payload:
+            occupancy = checks.StateOccupancyCheck('thread-seconds off ideal 2-bit states', args.tolerance)
+            error_checks = error_checks + (occupancy,)
+
+        # pick up after the frames a previous incremental run already checked
+        state = None
+        if args.incremental:
+            state = load_state(args.json + STATE_SUFFIX, vdif_file, args.payload, args.index_only)
+        if state is not None:
+            start_frame = state['stop_frame']
+            logger.info('resuming after {0} frames already checked'.format(start_frame))
+
+        # find how many frames to check
+        frames_to_check = max(0, stop_frame - start_frame)
+        if args.frames_to_check > 0:
+            frames_to_check = min(frames_to_check, args.frames_to_check)
+
+        # only run the checks of fields the index keeps if asked to
+        if args.index_only:
+            index_fields = set(INDEX_DTYPE.names)
+            left_out = list(check.desc for check in error_checks + sanity_checks if not set(check.fields) <= index_fields)
+            error_checks = tuple(check for check in error_checks if set(check.fields) <= index_fields)
+            sanity_checks = tuple(check for check in sanity_checks if set(check.fields) <= index_fields)
+            logger.info('checking only fields in the frame index, leaving out: {0}'.format(', '.join(left_out)))
+
+        # either sample windows spread across the frames...
+        all_checks = error_checks + sanity_checks
+        if args.sample > 0:
+            window = max(1, min(args.window, frames_to_check))
+            last_start = max(0, frames_to_check - window)
+            if args.random:
+                random = RandomState(args.seed)
+                starts = random.choice(last_start + 1, min(args.sample, last_start + 1), replace=False)
+            else:
+                starts = linspace(0, last_start, args.sample).round().astype(int)
+            windows = list((start_frame + start, start_frame + start + window) for start in unique(starts))
+            logger.info('sampling {0} windows of {1} frames'.format(len(windows), window))
+
+        # ...or split all of them into one chunk per job
+        else:
+            chunk_size = max(1, -(-frames_to_check // max(1, args.jobs)))
+            windows = list(
+                (start, min(start + chunk_size, start_frame + frames_to_check))
+                for start in range(start_frame, start_frame + frames_to_check, chunk_size)
+                )
+        chunks = list((args.filename, args.skip_bytes, args.mark6, args.index_only, start, stop, deepcopy(all_checks))
+                      for start, stop in windows)
+        frames_to_check = sum(stop - start for start, stop in windows)
+
+        # check every chunk, in parallel if asked to
+        if args.jobs > 1 and len(chunks) > 1:
+            logger.debug('checking {0} chunks with {1} jobs'.format(len(chunks), args.jobs))
+            pool = Pool(args.jobs)
+            chunk_checks = pool.map(check_frames, chunks)
+            pool.close()
+            pool.join()
+        else:
+            chunk_checks = list(check_frames(chunk) for chunk in chunks)
+
+        # new frames follow on from the previous run's results
+        if state is not None:
+            error_checks, sanity_checks = state['error_checks'], state['sanity_checks']
+            all_checks = error_checks + sanity_checks
+            continuity = all_checks[[type(check) for check in all_checks].index(checks.ContinuityCheck)]
+            if occupancy is not None:
+                occupancy = all_checks[[type(check) for check in all_checks].index(checks.StateOccupancyCheck)]
+
+        # merge chunk results in frame order
+        for checks_ in chunk_checks:
+            for check, chunk_check in zip(all_checks, checks_):
+                check.merge(chunk_check, contiguous=not args.sample)
+
+        # tell user we finished
+        logger.info('\nfinished checking {0} frames. printing summary...'.format(frames_to_check))
+
+        # show results from error-type checks
+        logger.info('\nprinting error-type check results...')
+        for i, check in enumerate(error_checks):
+            logger.info('error-type  check #{0}. {1}'.format(i, check))
+
+        # estimate error rates over the whole file from the sampled windows
+        rates = []
+        if args.sample > 0:
+            window_frames = list(stop - start for start, stop in windows)
+            logger.info('\nprinting error-type rate estimates (95% bounds) over {0} frames...'.format(stop_frame - start_frame))
+            for i, check in enumerate(error_checks):
+                if isinstance(check, checks.ContinuityCheck):
+                    for kind in ('lost', 'duplicate', 'reorder'):
+                        counts = list(checks_[i].results[kind] for checks_ in chunk_checks)
+                        frames = window_frames
+                        if kind == 'lost':
+                            frames = list(n + lost for n, lost in zip(window_frames, counts))
+                        rate, lower, upper = checks.estimate_rate(counts, frames)
+                        rates.append(dict(desc='{0} frames'.format(kind), rate=rate, lower=lower, upper=upper))
+                        logger.info('error-type  check #{0}. {1:<40s}: {2:.3e} [{3:.3e}, {4:.3e}] per frame'.format(
+                            i, '{0} frames'.format(kind), rate, lower, upper))
+                elif isinstance(check, checks.CountingCheck):
+                    counts = list(checks_[i].results for checks_ in chunk_checks)
+                    rate, lower, upper = checks.estimate_rate(counts, window_frames)
+                    rates.append(dict(desc=check.desc, rate=rate, lower=lower, upper=upper))
+                    logger.info('error-type  check #{0}. {1:<40s}: {2:.3e} [{3:.3e}, {4:.3e}] per frame'.format(
+                        i, check.desc, rate, lower, upper))
+
+        # show results from sanity-type checks
+        logger.info('\nprinting sanity-type check results...')
+        for i, check in enumerate(sanity_checks):
+            logger.info('sanity-type check #{0}. {1}'.format(i, check))
+
+        # show where frames went missing, were duplicated or reordered
+        gap_map = continuity.gap_map()
+        logger.info('\nprinting frame continuity gap map...')
+        for thread_id, station_id, kind, key, count, secs, data_frame in gap_map[:args.max_gaps]:
+            logger.info('thread {0} station {1!r}: {2:>9s} {3} frames from secs {4} frame {5}'.format(
+                thread_id, station_id, kind, count, secs, data_frame))
+        if len(gap_map) > args.max_gaps:
+            logger.info('... and {0} more'.format(len(gap_map) - args.max_gaps))
+
+        # show which seconds of which threads had skewed sample statistics
+        if occupancy is not None:
+            flagged = list(entry for entry in occupancy.occupancy() if entry[3])
+            logger.info('\nprinting 2-bit state occupancy flags (ideal {0})...'.format(
+                ' / '.join('{0:.2f}'.format(p) for p in occupancy.ideal)))
+            for thread_id, secs, percent, _ in flagged[:args.max_gaps]:
+                logger.info('thread {0} secs {1}: {2}'.format(
+                    thread_id, secs, ' / '.join('{0:.2f}'.format(p) for p in percent)))
+            if len(flagged) > args.max_gaps:
+                logger.info('... and {0} more'.format(len(flagged) - args.max_gaps))
+
+        # write out the report, and the check state for the next incremental run
+        if args.json is not None:
+            report.update(
+                start_frame=0 if state is not None else start_frame,
+                stop_frame=start_frame + frames_to_check, sampled=args.sample > 0, index_only=args.index_only,
+                error_checks=list(dict(desc=check.desc, results=check.results) for check in error_checks),
+                sanity_checks=list(dict(desc=check.desc, results=check.results) for check in sanity_checks),
+                gap_map=list(dict(zip(('thread_id', 'station_id', 'kind', 'key', 'count', 'secs', 'data_frame'), event))
+                             for event in gap_map),
+                )
+            if args.sample > 0:
+                report['rates'] = rates
+            if occupancy is not None:
+                report['occupancy'] = list(
+                    dict(thread_id=thread_id, secs=secs, percent=percent, flagged=flagged)
+                    for thread_id, secs, percent, flagged in occupancy.occupancy()
+                    )
+            write_atomic(args.json, json.dumps(jsonable(report), indent=2, sort_keys=True).encode('ascii'))
+            logger.debug('wrote report: {0}'.format(args.json))
+
+            if args.incremental:
+                write_atomic(args.json + STATE_SUFFIX, pickle.dumps(dict(
+                    filename=vdif_file.filename, skip_bytes=vdif_file.skip_bytes, frame_size=vdif_file.frame_size,
+                    first_header=vdif_file[0][:vdif_file.header_size].tobytes(),
+                    stop_frame=start_frame + frames_to_check, payload=args.payload, index_only=args.index_only,
+                    error_checks=error_checks, sanity_checks=sanity_checks,
+                    ), 2))
+
+        # finish up
+        logger.info('\nchecked quality for {0} frames of {1}'.format(frames_to_check, args.filename))
 
-# open the VDIF file
-logger.debug('opening: {0}'.format(args.filename))
-with open(args.filename, 'rb') as file_:
-
-    # skip bytes if requested
-    file_.seek(args.skip_bytes)
-
-    # get the first VDIF header
-    first_hdr = VDIFFrameHeader.from_bin(file_.read(32))
-    logger.debug('first header: {0}'.format(repr(first_hdr)))
-
-    # determine the packet size
-    pkt_size = first_hdr.frame_length * 8
-    logger.debug('packet size: {0} bytes'.format(pkt_size))
-
-    # is pkt_size possbily too big?
-    if pkt_size > 8224:
-        logger.warning('packet size possibly too big. check start byte offset')
-
-    # get the last VDIF header
-    file_.seek(-pkt_size, 2)
-    last_hdr = VDIFFrameHeader.from_bin(file_.read(32))
-    logger.debug('last header: {0}'.format(repr(last_hdr)))
-
-    # get start, stop, and total time
-    start = first_hdr.datetime()
-    stop  = last_hdr.datetime(end=True)
-    total = stop - start
-
-    # print out time-check info
-    logger.info('\nprint time-check information...')
-    logger.info('start time: {0:%d %b %Y %Z %X.%f}'.format(start))
-    logger.info('stop  time: {0:%d %b %Y %Z %X.%f}'.format(stop))
-    logger.info('total time: {0:f} secs'.format(total.seconds + total.microseconds * 1e-6))
-
-    # exit if user wants only time check
-    if args.tc_only:
-        sys.exit()
-
-    # must remember to seek back to start
-    file_.seek(args.skip_bytes)
-    
-    # keep track of frame counts
-    frame_n = 0
-
-    # go through every frame
-    end_of_frames = False
-    while not end_of_frames:
-    
-        # read one packet
-        pkt = file_.read(pkt_size)
-    
-        # check if we reached eof
-        if not len(pkt) == pkt_size:
-            logger.debug('reach eof for {0}'.format(file_.name))
-            end_of_frames = True
-            break
-
-        # create frame object
-        header = VDIFFrameHeader.from_bin(pkt)
-
-        # go through every error-type check
-        for check in error_checks:
-            check(header)
-
-        # go through every sanity-type check
-        for check in sanity_checks:
-            check(header)
-
-        # increment frame count
-        frame_n += 1
-
-        # every so often tell user we're still alive
-        if frame_n % 2048 == 0:
-            logger.debug('still alive! currently on frame {0}'.format(frame_n))
-
-        # exit if we've check all requested frames
-        if frame_n == args.frames_to_check:
-            end_of_frames = True
-
-    # tell user we finished
-    logger.info('\nfinished checking {0} frames. printing summary...'.format(frame_n))
-
-    # show results from error-type checks
-    logger.info('\nprinting error-type check results...')
-    for i, check in enumerate(error_checks):
-        logger.info('error-type  check #{0}. {1}'.format(i, check))
-
-    # show results from sanity-type checks
-    logger.info('\nprinting sanity-type check results...')
-    for i, check in enumerate(sanity_checks):
-        logger.info('sanity-type check #{0}. {1}'.format(i, check))
-
-    # finish up
-    logger.info('\nchecked quality for {0} frames of {1}'.format(frame_n, args.filename))
+if __name__ == '__main__':
+    main()
@@ -1,223 +1,396 @@
 import logging
 import argparse
-from itertools import combinations
+from itertools import chain
+from multiprocessing import Pool
 
-import pylab
-from numpy.fft import fftshift, rfft, irfft
+from numpy.fft import fftshift, irfft
 from numpy import (
-    pi, log10, angle, sqrt, real, conjugate, 
-    split, arange, linspace, zeros_like
+    pi, log10, angle, sqrt, real,
+    arange, array, linspace, searchsorted
     )
 
-from vdif import VDIFFrameHeader, VDIFFrame
-
-# parse the user's command line arguments
-parser = argparse.ArgumentParser(description='Simulate VDIF data from multiple stations')
-parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
-parser.add_argument('--nfft', dest='NFFT', default=1024, type=int, help='size of FFT to use')
-parser.add_argument('-n', '--frames-to-check', dest='frames_to_check', default=-1, 
-                    type=int, help='number of frames (from the beginning) to check (default: all)')
-parser.add_argument('-s', '--sample-rate', dest='sample_rate', default=4096.0, 
-                    type=float, help='rate at which the data was sampled in MHz (default: 4096.0)')
-parser.add_argument('files', type=str, nargs='+', help='VDIF files with data to correlate')
-args = parser.parse_args()
-
-# set up some basic logging
-logging.basicConfig(format='%(asctime)-15s - %(message)s')
+from vdif import parse_utc, VDIFStream, stream_runs, run_indices
+from mark6_sg import open_recording
+from correlator import (
+    FXCorrelator, XFCorrelator, FRAMES_PER_BATCH, save_visibilities, fringe_search_baselines, delay_search
+    )
+from vanvleck import VanVleckCorrection, SUPPORTED_BITS as VAN_VLECK_BITS
+
 logger = logging.getLogger('vdif_corr')
-logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
- 
-# open all files into a list
-logger.debug('opening files for reading')
-files = list(open(filename, 'rb') for filename in args.files)
-
-# get the first VDIF headers for all files
-logger.debug('grabbing first header from every file')
-first_hdrs = list(VDIFFrameHeader.from_bin(file_.read(32)) for file_ in files)
-
-# must remember to seek all back to zero
-logger.debug('seeking back to zero before parsing files')
-for file_ in files:
-    file_.seek(0)
-
-# set some global values (from first header)
-ref_epoch = first_hdrs[0].ref_epoch
-legacy_mode = first_hdrs[0].legacy_mode
-frame_length = first_hdrs[0].frame_length
-bits_per_sample = first_hdrs[0].bits_per_sample
-
-# do some sanity checks
-for hdr in first_hdrs:
-
-    # print station ID's
-    logger.info('found station ID#{0}'.format(hdr.station_id))
-
-    # check all have the same reference epoch
-    if not hdr.ref_epoch == ref_epoch:
-        err_msg = 'mismatched ref_epoch {0}, expected {1}'.format(hdr.ref_epoch, ref_epoch)
-        logger.error(err_msg)
-        raise ValueError(err_msg)
-
-    # check all have same legacy mode
-    if not hdr.legacy_mode == legacy_mode:
-        err_msg = 'mismatched legacy_mode {0}, expected {1}'.format(hdr.legacy_mode, legacy_mode)
-        logger.error(err_msg)
-        raise ValueError(err_msg)
-
-    # check all frame lengths are the same
-    if not hdr.frame_length == frame_length:
-        err_msg = 'mismatched frame_length {0}, expected {1}'.format(hdr.frame_length, frame_length)
-        logger.error(err_msg)
-        raise ValueError(err_msg)
-
-    # check all have the same sample bitwidth
-    if not hdr.bits_per_sample == bits_per_sample:
-        err_msg = 'mismatched bits_per_sample {0}, expected {1}'.format(hdr.bits_per_sample, bits_per_sample)
-        logger.error(err_msg)
-        raise ValueError(err_msg)
-
-# determine the packet size
-pkt_size = frame_length * 8
-logger.debug('packet size: {0} bytes'.format(pkt_size))
-
-# determine frame offsets needed to correlate
-frame_offsets = list(-hdr.data_frame + first_hdrs[0].data_frame for hdr in first_hdrs)
-frame_offsets = list(off + abs(min(frame_offsets)) for off in frame_offsets)
-logger.debug('frame offsets determined: {0}'.format(frame_offsets))
-
-# seek forward files by their offsets
-for i, file_ in enumerate(files):
-    file_.seek(frame_offsets[i] * pkt_size)
-
-# set some initial values
-autos = {}
-cross = {}
-elements = list(file_.name for file_ in files)
-baselines = list(combinations(elements, 2)) + list((e, e) for e in elements)
-
-# keep track of frame counts
-frame_n = 0
-
-# go through every frame
-end_of_frames = False
-while not end_of_frames:
-
-    # grab a single packet from each file
-    spectra = dict((file_.name, None) for file_ in files)
-    for file_ in files:
 
-        # read one packet
-        pkt = file_.read(pkt_size)
+def select_sources(files, thread):
+    """ Return the whole files, or the one stream of the given thread in each """
 
-        # check if we reached eof
-        if not len(pkt) == pkt_size:
-            logger.debug('reach eof for {0}'.format(file_.name))
-            end_of_frames = True
-            break
+    if thread is None:
+        return files
 
-        # create frame object
-        frame = VDIFFrame.from_bin(pkt)
-
-        # do an FFT on each frame
-        spectra[file_.name] = rfft(split(frame.data, len(frame.data)/args.NFFT), axis=1)
-
-    # integrate the cross spectra
-    if not end_of_frames:
-        for baseline in baselines:
-            left = spectra[baseline[0]]
-            right = spectra[baseline[1]]
-            prod = (left * conjugate(right)).sum(axis=0)
-            if baseline[0] == baseline[1]:
-                part_autos = autos.get(baseline[0], zeros_like(prod))
-                autos[baseline[0]] = part_autos + prod
-                autos[baseline[0]][0] = 0 # zero-out DC
-            else:
-                part_cross = cross.get(baseline, zeros_like(prod))
-                cross[baseline] = part_cross + prod
-                cross[baseline][0] = 0 # zero-out DC
-
-    # increment frame count
-    frame_n += 1
-
-    # every so often tell user we're still alive
-    if frame_n % 2048 == 0:
-        logger.info('still alive! currently on frame {0}'.format(frame_n))
-
-    # exit if we've check all requested frames
-    if frame_n == args.frames_to_check:
-        end_of_frames = True
-
-# find our frequency range
-freqs = linspace(0.0, args.sample_rate/2, num=1+args.NFFT/2)
-
-# plot the auto spectra
-pylab.figure()
-for name, auto in autos.iteritems():
-    pylab.step(freqs[1:], 10*log10(abs(auto[1:])), label=name)
-    # pylab.plot(abs(auto[1:]), label=name)
-    # pylab.semilogy(freqs, abs(auto[1:]), label=name)
-pylab.title('Auto-correlation Amplitudes')
-pylab.ylabel('Amplitude (dB)')
-pylab.xlabel('Frequency (MHz)')
-pylab.xlim(0, args.sample_rate/2)
-pylab.legend()
-
-# plot the cross phase spectra and amplitude
-for baseline in cross:
-    pylab.figure()
-    pylab.subplot(2, 1, 1)
-    pylab.plot(freqs[1:], 10*log10(abs(cross[baseline])[1:]), '-', label='{0} X {1}'.format(*baseline))
-    pylab.title('Cross-correlation Amplitude')
-    pylab.ylabel('Amplidue (dB)')
-    pylab.xlabel('Frequency (MHz)')
-    pylab.xlim(0, args.sample_rate/2)
-    pylab.legend()
-    pylab.subplot(2, 1, 2)
-    pylab.plot(freqs[1:], angle(cross[baseline])[1:], '.', label='{0} X {1}'.format(*baseline))
-    pylab.title('Cross-correlation Phase')
-    pylab.ylabel('Phase (rads)')
-    pylab.xlabel('Frequency (MHz)')
-    pylab.xlim(0, args.sample_rate/2)
-    pylab.ylim(-pi, pi)
-    pylab.legend()
-
-# plot the cross lags
-delref = elements[0]
-delays = dict.fromkeys(elements)
-delays[delref] = 0
-sample_period = 1e3 / args.sample_rate
-for baseline in cross:
-    pylab.figure()
-    norm = sqrt(real(irfft(autos[baseline[0]]).max() * irfft(autos[baseline[1]]).max()))
-    corr_coeff = fftshift(irfft(cross[baseline]))/norm
-    peak = corr_coeff.max().real
-    noise = corr_coeff.sum().real / len(corr_coeff)
-    snr = 10*log10(peak/noise)
-    lags = linspace(-sample_period * args.NFFT/2, sample_period * args.NFFT/2, num=args.NFFT)
-    delay_lag = corr_coeff.argmax() - args.NFFT/2
-    if baseline[0] == delref:
-        delays[baseline[1]] = delay_lag
-    elif baseline[1] == delref:
-        delays[baseline[0]] = -delay_lag
-    delay_ns = lags[corr_coeff.argmax()]
-    pylab.plot(lags, corr_coeff)
-    pylab.title('{0} (x) {1}'.format(*baseline))
-    pylab.annotate('\nCorr. coef.:{0:.2f}\nSNR: {1:.2f} dB\nDelay (lags): {2}\nDelay (ns): {3:.2f}'.format(peak, snr, delay_lag, delay_ns), 
-                   xy=(delay_ns, peak), xytext=(0.8, 0.8), textcoords='axes fraction', backgroundcolor='white',
-                   arrowprops=dict(facecolor='black', width=0.1, headwidth=4, shrink=0.1))
-    pylab.ylabel('Correlation Coefficient')
-    pylab.xlabel('Delay (ns)')
-    pylab.xlim(-sample_period*args.NFFT/4, sample_period*args.NFFT/4)
-
-# print out our measured delays
-for element in elements:
-    min_del = min(delays.values())
-    logger.info('{0} delay is {1} samples'.format(element, delays[element] + abs(min_del)))
-
-# show all plots
-pylab.show()
-
-# close all files in the list
-logger.debug('closing all open files')
-for file_ in files: 
-    file_.close()
+    sources = []
+    for file_ in files:
+        streams = list(stream for stream in file_.streams() if stream.thread_id == thread)
+        if len(streams) != 1:
+            err_msg = 'found {0} streams with thread {1} in {2}'.format(len(streams), thread, file_.filename)
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+        logger.debug('using {0} of {1}'.format(streams[0], file_.filename))
+        sources.append(streams[0])
+
+    return sources
+
+def stream_specs(sources):
+    """ Return (thread, station, frame runs) of the streams among sources, or None for whole files """
+
+    if not all(isinstance(source, VDIFStream) for source in sources):
+        return None
+    return list((source.thread_id, source.station_id, stream_runs(source.indices)) for source in sources)
+
+def correlate_segment(segment):
+    """ Correlate frames [start, stop) with freshly opened files, returning partial dumps
+
+    Streams selected by the parent are rebuilt from their frame runs
+    (see stream_specs), so the files are not demultiplexed again.
+    """
+
+    filenames, mark6, streams, offsets, sample_offsets, nfft, frames_per_dump, batch, start, stop = segment
+    files = list(open_recording(filename, mark6) for filename in filenames)
+    try:
+        sources = files
+        if streams is not None:
+            sources = list(VDIFStream(file_, thread_id, station_id, run_indices(runs))
+                           for file_, (thread_id, station_id, runs) in zip(files, streams))
+        correlator = FXCorrelator(sources, offsets, nfft, frames_per_dump, batch, sample_offsets)
+        return list(correlator.partial_dumps(start, stop))
+    finally:
+        for file_ in files:
+            file_.close()
+
+def main():
+    """ Correlate the VDIF files named on the command line """
+
+    # parse the user's command line arguments
+    parser = argparse.ArgumentParser(description='Simulate VDIF data from multiple stations')
+    parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
+    parser.add_argument('--nfft', dest='NFFT', default=1024, type=int, help='size of FFT to use')
+    parser.add_argument('-n', '--frames-to-check', dest='frames_to_check', default=-1, 
+                        type=int, help='number of frames (from the beginning) to check (default: all)')
+    parser.add_argument('-s', '--sample-rate', dest='sample_rate', default=4096.0, 
+                        type=float, help='rate at which the data was sampled in MHz (default: 4096.0)')
+    parser.add_argument('--start', dest='start', metavar='UTC', type=parse_utc, default=None,
+                        help='correlate from the first frame at or after UTC (e.g. 2017-04-05T23:10:00 or 2017y095d23h10m00s)')
+    parser.add_argument('--duration', dest='duration', metavar='SECS', type=float, default=None,
+                        help='correlate only SECS seconds of data (default: to end of files)')
+    parser.add_argument('--mark6', dest='mark6', action='store_true',
+                        help='files are Mark6 scan names (or globs of their scatter-gather files) read in place')
+    parser.add_argument('--dump', dest='dump', metavar='SECS', type=float, default=None,
+                        help='emit visibilities every SECS seconds of data (default: one dump for everything)')
+    parser.add_argument('--batch', dest='batch', metavar='M', type=int, default=FRAMES_PER_BATCH,
+                        help='decode and FFT M frames per station at once (default: {0})'.format(FRAMES_PER_BATCH))
+    parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=1,
+                        help='split the frames into N segments correlated in parallel processes (default: 1)')
+    parser.add_argument('-o', '--output', dest='output', metavar='FILE', type=str, default=None,
+                        help='save autos, crosses, frequencies and dump times/weights to FILE (.npz, see correlator.load_visibilities)')
+    parser.add_argument('--no-plot', dest='no_plot', action='store_true',
+                        help='do not plot anything (e.g. for batch jobs)')
+    parser.add_argument('--fringe', dest='fringe', action='store_true',
+                        help='search the dumps for fractional delay and delay rate per baseline')
+    parser.add_argument('--ref-freq', dest='ref_freq', metavar='MHZ', type=float, default=None,
+                        help='sky frequency the fringe rate is converted to delay rate at (default: band center)')
+    parser.add_argument('--no-van-vleck', dest='no_van_vleck', action='store_true',
+                        help='do not correct the visibilities for quantization (Van Vleck correction)')
+    parser.add_argument('--xf', dest='xf', metavar='LAGS', type=int, default=None,
+                        help='only find delays, correlating lags -LAGS..LAGS in the time domain (XF mode, faster than FX up to about 200 lags on 2-bit data)')
+    parser.add_argument('--search-delay', dest='search_delay', action='store_true',
+                        help='find and remove station delays first, coarse to fine over a few short segments')
+    parser.add_argument('--search-nfft', dest='search_nfft', metavar='N', type=int, default=2**20,
+                        help='FFT size of the coarse delay search, which sees delays up to N/2 samples (default: 2**20)')
+    parser.add_argument('--thread', dest='thread', metavar='ID', type=int, default=None,
+                        help='correlate only frames of thread ID from every file (default: all frames)')
+    parser.add_argument('files', type=str, nargs='+', help='VDIF files with data to correlate')
+    args = parser.parse_args()
+
+    # XF mode forms no spectra, so there is nothing to save or fringe-fit
+    if args.xf is not None and (args.output is not None or args.fringe or args.jobs > 1 or args.search_delay):
+        parser.error('--xf cannot be combined with -o, --fringe, --jobs or --search-delay')
+
+    # set up some basic logging
+    logging.basicConfig(format='%(asctime)-15s - %(message)s')
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    # open all files into a list
+    logger.debug('opening files for reading')
+    files = list(open_recording(filename, args.mark6, sample_rate=args.sample_rate*1e6) for filename in args.files)
+
+    # the sidecar indices (see vdif_index.py) make time seeks cheap
+    for file_ in files:
+        if file_.index is not None:
+            logger.debug('using frame index: {0}'.format(file_.index_filename))
+
+    # read either whole files or just one thread demultiplexed from each
+    sources = select_sources(files, args.thread)
+
+    # find the frames to start from, seeking in time if requested
+    start_frames = list(0 for file_ in files)
+    if args.start is not None:
+        start_frames = list(file_.seek_time(args.start) for file_ in files)
+        if args.thread is not None:
+            start_frames = list(int(searchsorted(source.indices, start_frame))
+                                for source, start_frame in zip(sources, start_frames))
+        logger.info('seeking to frames {0} for start time {1:%d %b %Y %Z %X.%f}'.format(start_frames, args.start))
+        for i, file_ in enumerate(files):
+            if not start_frames[i] < len(sources[i]):
+                err_msg = 'start time is past the end of {0}'.format(file_.filename)
+                logger.error(err_msg)
+                raise ValueError(err_msg)
+
+    # get the first VDIF headers for all files
+    logger.debug('grabbing first header from every file')
+    first_hdrs = list(source.header(start_frames[i]) for i, source in enumerate(sources))
+
+    # set some global values (from first header)
+    ref_epoch = first_hdrs[0].ref_epoch
+    legacy_mode = first_hdrs[0].legacy_mode
+    frame_length = first_hdrs[0].frame_length
+    bits_per_sample = first_hdrs[0].bits_per_sample
+
+    # do some sanity checks
+    for hdr in first_hdrs:
+
+        # print station ID's
+        logger.info('found station ID#{0}'.format(hdr.station_id))
+
+        # check all have the same reference epoch
+        if not hdr.ref_epoch == ref_epoch:
+            err_msg = 'mismatched ref_epoch {0}, expected {1}'.format(hdr.ref_epoch, ref_epoch)
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+
+        # check all have same legacy mode
+        if not hdr.legacy_mode == legacy_mode:
+            err_msg = 'mismatched legacy_mode {0}, expected {1}'.format(hdr.legacy_mode, legacy_mode)
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+
+        # check all frame lengths are the same
+        if not hdr.frame_length == frame_length:
+            err_msg = 'mismatched frame_length {0}, expected {1}'.format(hdr.frame_length, frame_length)
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+
+        # check all have the same sample bitwidth
+        if not hdr.bits_per_sample == bits_per_sample:
+            err_msg = 'mismatched bits_per_sample {0}, expected {1}'.format(hdr.bits_per_sample, bits_per_sample)
+            logger.error(err_msg)
+            raise ValueError(err_msg)
+
+    # determine the packet size
+    pkt_size = frame_length * 8
+    logger.debug('packet size: {0} bytes'.format(pkt_size))
+
+    # determine frame offsets needed to correlate
+    frame_offsets = list(-hdr.data_frame + first_hdrs[0].data_frame for hdr in first_hdrs)
+    frame_offsets = list(off + abs(min(frame_offsets)) for off in frame_offsets)
+    frame_offsets = list(off + start_frames[i] for i, off in enumerate(frame_offsets))
+    logger.debug('frame offsets determined: {0}'.format(frame_offsets))
+
+    # line the stations up to the sample if asked to
+    sample_offsets = list(0 for source in sources)
+    if args.search_delay:
+        logger.debug('searching for delays with {0}- then {1}-point FFTs'.format(args.search_nfft, args.NFFT))
+        frame_offsets, sample_offsets, searched = delay_search(sources, frame_offsets, args.search_nfft, args.NFFT)
+        for element, (delay, peak) in zip(args.files, searched):
+            logger.info('{0} delay is {1:.3f} samples ({2:.6f} us), corr. coef. {3:.3f}'.format(
+                element, delay, delay / args.sample_rate, peak))
+        logger.debug('frame offsets {0}, sample offsets {1}'.format(frame_offsets, sample_offsets))
+
+    # limit the number of frames to the requested duration
+    frames_to_check = args.frames_to_check
+    if args.duration is not None:
+        frames_in_duration = int(round(args.duration / first_hdrs[0].frame_period()))
+        if frames_to_check < 0 or frames_in_duration < frames_to_check:
+            frames_to_check = frames_in_duration
+        logger.debug('correlating {0} frames for {1:f} secs'.format(frames_to_check, args.duration))
+
+    # set some initial values
+    autos = {}
+    cross = {}
+    elements = list(file_.filename for file_ in files)
+
+    # correlate everything as one dump unless asked to split it up
+    frames_available = min(len(source) - frame_offsets[i] - (1 if sample_offsets[i] else 0)
+                           for i, source in enumerate(sources))
+    if frames_to_check < 0 or frames_available < frames_to_check:
+        frames_to_check = max(0, frames_available)
+    frames_per_dump = max(1, frames_to_check)
+    if args.dump is not None:
+        frames_per_dump = max(1, int(round(args.dump / first_hdrs[0].frame_period())))
+    logger.debug('correlating {0} frames in dumps of {1}'.format(frames_to_check, frames_per_dump))
+
+    # go through all frames a batch at a time, in parallel segments if asked to
+    correlator = FXCorrelator(sources, frame_offsets, args.NFFT, frames_per_dump, args.batch, sample_offsets)
+    if args.xf is not None:
+        partial_dumps = []
+    elif args.jobs > 1:
+        bounds = linspace(0, frames_to_check, args.jobs + 1).round().astype(int)
+        streams = stream_specs(sources)
+        segments = list(
+            (args.files, args.mark6, streams, frame_offsets, sample_offsets, args.NFFT, frames_per_dump, args.batch,
+             start, stop)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if start < stop
+            )
+        logger.debug('correlating {0} segments with {1} jobs'.format(len(segments), args.jobs))
+        pool = Pool(args.jobs)
+        partial_dumps = list(chain(*pool.map(correlate_segment, segments)))
+        pool.close()
+        pool.join()
+    else:
+        partial_dumps = correlator.partial_dumps(0, frames_to_check)
+
+    # add up the parts of every dump
+    dump_frames = {}
+    dump_sums = {}
+    for dump_n, frames, vis in partial_dumps:
+        dump_frames[dump_n] = dump_frames.get(dump_n, 0) + frames
+        dump_sums[dump_n] = dump_sums[dump_n] + vis if dump_n in dump_sums else vis
+
+    # then time-stamp them in order, correcting each for quantization
+    # (only few-bit samples need it, or could have it tabulated)
+    van_vleck = None
+    if not args.no_van_vleck:
+        if bits_per_sample in VAN_VLECK_BITS:
+            van_vleck = VanVleckCorrection(bits_per_sample)
+        else:
+            logger.debug('no Van Vleck correction for {0}-bit samples'.format(bits_per_sample))
+    dump_times = []
+    dump_vis = []
+    for dump_n in sorted(dump_sums):
+        dump_start = dump_n * frames_per_dump
+        dump_times.append(sources[0].header(frame_offsets[0] + dump_start).datetime())
+        dump_vis.append(dump_sums[dump_n])
+        logger.info('dump {0} at {1:%d %b %Y %Z %X.%f}: {2} valid frames'.format(dump_n, dump_times[-1], dump_frames[dump_n]))
+        if van_vleck is not None:
+            n_samples = dump_frames[dump_n] * correlator.samples_per_frame
+            dump_vis[-1], ratios = van_vleck.correct_visibilities(dump_vis[-1], correlator.baselines, n_samples)
+            logger.debug('dump {0} threshold/sigma: {1}'.format(
+                dump_n, ', '.join('{0:.3f}'.format(ratios[n]) for n in sorted(ratios))))
+
+    # integrate all dumps for the plots
+    for b, (left, right) in enumerate(correlator.baselines):
+        integrated = sum(vis[b] for vis in dump_vis)
+        if left == right:
+            autos[elements[left]] = integrated
+        else:
+            cross[(elements[left], elements[right])] = integrated
+
+    # find our frequency range
+    freqs = linspace(0.0, args.sample_rate/2, num=1+args.NFFT//2)
+
+    # save the product so it can be analyzed again without the raw data
+    if args.output is not None:
+        save_visibilities(args.output, elements, correlator.baselines, freqs,
+                          dump_times, list(dump_frames[n] for n in sorted(dump_frames)), frames_per_dump, dump_vis)
+        logger.info('saved {0} dumps to {1}'.format(len(dump_vis), args.output))
+
+    # plot the auto spectra
+    if not args.no_plot:
+        import pylab
+    if autos and not args.no_plot:
+        pylab.figure()
+        for name, auto in autos.items():
+            pylab.step(freqs[1:], 10*log10(abs(auto[1:])), label=name)
+            # pylab.plot(abs(auto[1:]), label=name)
+            # pylab.semilogy(freqs, abs(auto[1:]), label=name)
+        pylab.title('Auto-correlation Amplitudes')
+        pylab.ylabel('Amplitude (dB)')
+        pylab.xlabel('Frequency (MHz)')
+        pylab.xlim(0, args.sample_rate/2)
+        pylab.legend()
+
+    # plot the cross phase spectra and amplitude
+    for baseline in cross:
+        if args.no_plot:
+            break
+        pylab.figure()
+        pylab.subplot(2, 1, 1)
+        pylab.plot(freqs[1:], 10*log10(abs(cross[baseline])[1:]), '-', label='{0} X {1}'.format(*baseline))
+        pylab.title('Cross-correlation Amplitude')
+        pylab.ylabel('Amplidue (dB)')
+        pylab.xlabel('Frequency (MHz)')
+        pylab.xlim(0, args.sample_rate/2)
+        pylab.legend()
+        pylab.subplot(2, 1, 2)
+        pylab.plot(freqs[1:], angle(cross[baseline])[1:], '.', label='{0} X {1}'.format(*baseline))
+        pylab.title('Cross-correlation Phase')
+        pylab.ylabel('Phase (rads)')
+        pylab.xlabel('Frequency (MHz)')
+        pylab.xlim(0, args.sample_rate/2)
+        pylab.ylim(-pi, pi)
+        pylab.legend()
+
+    # get the cross lags, in XF mode straight from the samples
+    lag_coeffs = {}
+    if args.xf is not None:
+        xf = XFCorrelator(sources, frame_offsets, args.xf)
+        lag_numbers = xf.lags
+        logger.debug('correlating lags {0}..{1} of {2} frames'.format(-args.xf, args.xf, frames_to_check))
+        for (left, right), corr_coeff in zip(xf.baselines, xf.coefficients(0, frames_to_check, van_vleck)):
+            lag_coeffs[(elements[left], elements[right])] = corr_coeff
+    else:
+        lag_numbers = arange(-(args.NFFT//2), args.NFFT//2)
+        for baseline in cross:
+            norm = sqrt(real(irfft(autos[baseline[0]])[0] * irfft(autos[baseline[1]])[0]))
+            lag_coeffs[baseline] = fftshift(irfft(cross[baseline]))/norm
+
+    # find (and plot) the delays
+    delref = elements[0]
+    delays = dict.fromkeys(elements)
+    delays[delref] = 0
+    sample_period = 1e3 / args.sample_rate
+    lags = lag_numbers * sample_period
+    for baseline, corr_coeff in lag_coeffs.items():
+        peak = corr_coeff.max().real
+        noise = corr_coeff.sum().real / len(corr_coeff)
+        snr = 10*log10(peak/noise)
+        delay_lag = lag_numbers[corr_coeff.argmax()]
+        if baseline[0] == delref:
+            delays[baseline[1]] = delay_lag
+        elif baseline[1] == delref:
+            delays[baseline[0]] = -delay_lag
+        delay_ns = lags[corr_coeff.argmax()]
+        if args.no_plot:
+            continue
+        pylab.figure()
+        pylab.plot(lags, corr_coeff)
+        pylab.title('{0} (x) {1}'.format(*baseline))
+        pylab.annotate('\nCorr. coef.:{0:.2f}\nSNR: {1:.2f} dB\nDelay (lags): {2}\nDelay (ns): {3:.2f}'.format(peak, snr, delay_lag, delay_ns), 
+                       xy=(delay_ns, peak), xytext=(0.8, 0.8), textcoords='axes fraction', backgroundcolor='white',
+                       arrowprops=dict(facecolor='black', width=0.1, headwidth=4, shrink=0.1))
+        pylab.ylabel('Correlation Coefficient')
+        pylab.xlabel('Delay (ns)')
+        pylab.xlim(lags[len(lags)//4], lags[-len(lags)//4])
+
+    # print out our measured delays
+    for element in elements:
+        min_del = min(delays.values())
+        logger.info('{0} delay is {1} samples'.format(element, delays[element] + abs(min_del)))
+
+    # search for fringes across the dumps, which can follow a drifting delay
+    if args.fringe and dump_vis:
+        ref_freq = 1e6 * (args.ref_freq if args.ref_freq is not None else args.sample_rate/4)
+        dump_secs = frames_per_dump * first_hdrs[0].frame_period()
+        weights = array(list(dump_frames[n] for n in sorted(dump_frames)), float) / frames_per_dump
+        for left, right, fringe in fringe_search_baselines(array(dump_vis), correlator.baselines, dump_secs,
+                                                           1e6 * args.sample_rate / args.NFFT, weights):
+            logger.info('{0} (x) {1}: delay {2:.3f} samples, rate {3:.3e} Hz ({4:.3e} s/s), amp {5:.3e}, SNR {6:.1f}'.format(
+                elements[left], elements[right], fringe['delay'] * args.sample_rate * 1e6, fringe['rate'],
+                -fringe['rate'] / ref_freq, fringe['amplitude'], fringe['snr']))
+
+    # show all plots
+    if not args.no_plot:
+        pylab.show()
+
+    # close all files in the list
+    logger.debug('closing all open files')
+    for file_ in files: 
+        file_.close()
+
+if __name__ == '__main__':
+    main()
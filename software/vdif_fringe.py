@@ -0,0 +1,39 @@
+import logging
+import argparse
+
+from correlator import load_visibilities, fringe_search_baselines, FRINGE_PAD
+
+# parse the user's command line arguments
+parser = argparse.ArgumentParser(description='search saved vdif_corr visibilities for delay and delay rate')
+parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
+parser.add_argument('--pad', dest='pad', metavar='N', type=int, default=FRINGE_PAD,
+                    help='zero-pad the delay and rate FFTs N times (default: {0})'.format(FRINGE_PAD))
+parser.add_argument('--ref-freq', dest='ref_freq', metavar='MHZ', type=float, default=None,
+                    help='sky frequency the fringe rate is converted to delay rate at (default: band center)')
+parser.add_argument('filename', type=str, help='visibilities saved by vdif_corr.py -o')
+args = parser.parse_args()
+
+# set up some basic logging
+logging.basicConfig(format='%(asctime)-15s - %(message)s')
+logger = logging.getLogger('vdif_fringe')
+logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+# load the correlation product
+product = load_visibilities(args.filename)
+elements = list(str(element) for element in product['elements'])
+freqs = product['freqs']
+logger.debug('loaded {0} dumps of {1} baselines'.format(*product['vis'].shape[:2]))
+
+# dump spacing and channel width (MHz) give the rate and delay axes
+dump_times = product['dump_times']
+dump_secs = (dump_times[-1] - dump_times[0]) / (len(dump_times) - 1) if len(dump_times) > 1 else 1.0
+channel_width = 1e6 * (freqs[1] - freqs[0])
+sample_rate = 2e6 * freqs[-1]
+ref_freq = 1e6 * args.ref_freq if args.ref_freq is not None else sample_rate / 4
+
+# search every baseline
+for left, right, fringe in fringe_search_baselines(product['vis'], product['baselines'], dump_secs,
+                                                   channel_width, product['weights'], args.pad):
+    logger.info('{0} (x) {1}: delay {2:.3f} samples, rate {3:.3e} Hz ({4:.3e} s/s), amp {5:.3e}, SNR {6:.1f}'.format(
+        elements[left], elements[right], fringe['delay'] * sample_rate, fringe['rate'],
+        -fringe['rate'] / ref_freq, fringe['amplitude'], fringe['snr']))
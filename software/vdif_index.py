@@ -0,0 +1,30 @@
+import logging
+import argparse
+
+from vdif import VDIFFile
+
+# parse the user's command line arguments
+parser = argparse.ArgumentParser(description='build sidecar frame indices for VDIF files')
+parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
+parser.add_argument('-f', '--force', dest='force', action='store_true', help='rebuild indices that are up to date')
+parser.add_argument('-s', '--skip-bytes', metavar="SKIP_BYTES", dest='skip_bytes', type=int, default=0,
+                    help='if given the index will ignore the first SKIP_BYTES of each file')
+parser.add_argument('files', type=str, nargs='+', help='VDIF files to index')
+args = parser.parse_args()
+
+# set up some basic logging
+logging.basicConfig(format='%(asctime)-15s - %(message)s')
+logger = logging.getLogger('vdif_index')
+logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+for filename in args.files:
+    with VDIFFile(filename, skip_bytes=args.skip_bytes) as vdif_file:
+
+        # nothing to do if the index is still good
+        if vdif_file.index is not None and not args.force:
+            logger.info('{0} is up to date'.format(vdif_file.index_filename))
+            continue
+
+        logger.debug('indexing {0} frames of {1}'.format(len(vdif_file), filename))
+        vdif_file.build_index()
+        logger.info('wrote {0} with {1} frames'.format(vdif_file.index_filename, len(vdif_file)))
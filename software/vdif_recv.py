@@ -1,77 +1,75 @@
 #!/usr/bin/env python2.7
 import logging
-import datetime
-import sys, socket, struct
-
-from vdif import VDIFFrame
-
+import argparse
+
+from vdif import VDIFFile
+from capture import Capture, FRAME_SIZE, PSN_SIZE, PACKETS_PER_CHUNK, RING_BYTES, RCVBUF_BYTES, RECV_BATCH
+
+# the two R2DBE 10 GbE interfaces
+DEFAULT_ADDRESSES = ('172.16.3.16:4001', '172.16.5.16:4001')
+
+def parse_address(string):
+    """ Parse HOST:PORT into a (host, port) tuple """
+    host, _, port = string.rpartition(':')
+    return (host, int(port))
+
+# parse the user's command line arguments
+parser = argparse.ArgumentParser(description='Capture VDIF packets from R2DBE interfaces to one file each')
+parser.add_argument('-v', dest='verbose', action='store_true', help='display debugging logs')
+parser.add_argument('-b', '--bind', dest='addresses', metavar='HOST:PORT', type=parse_address, action='append',
+                    default=None, help='interface to capture from, repeat for more (default: {0})'.format(
+                        ' and '.join(DEFAULT_ADDRESSES)))
+parser.add_argument('--rcvbuf', dest='rcvbuf', metavar='MB', type=float, default=RCVBUF_BYTES / 2.0**20,
+                    help='socket receive buffer size (default: {0:.0f})'.format(RCVBUF_BYTES / 2.0**20))
+parser.add_argument('--ring', dest='ring', metavar='MB', type=float, default=RING_BYTES / 2.0**20,
+                    help='capture ring size per interface (default: {0:.0f})'.format(RING_BYTES / 2.0**20))
+parser.add_argument('--chunk', dest='chunk', metavar='PACKETS', type=int, default=PACKETS_PER_CHUNK,
+                    help='packets per chunk written to disk (default: {0})'.format(PACKETS_PER_CHUNK))
+parser.add_argument('--batch', dest='batch', metavar='PACKETS', type=int, default=RECV_BATCH,
+                    help='packets pulled per recvmmsg call, 1 for one recv_into per packet (default: {0})'.format(
+                        RECV_BATCH))
+parser.add_argument('frames_to_capture', type=int, help='number of frames to capture per interface')
+parser.add_argument('prefix', type=str, help='write frames of interface n to PREFIX_chan<n>.vdif')
+args = parser.parse_args()
+
+# set up some basic logging
 logging.basicConfig(format='%(asctime)-15s - %(message)s')
 logger = logging.getLogger('vdif_recv')
-logger.setLevel(logging.DEBUG)
-
-CHANNELS = 2
-FRAME_HDR_SIZE = 32
-FRAME_DAT_SIZE = 8192
-FRAME_SIZE = FRAME_HDR_SIZE + FRAME_DAT_SIZE
-
-frames_to_capture = int(sys.argv[1])
-
-sock = []
-sock.append(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
-sock[-1].bind(("172.16.3.16", 4001))
-sock.append(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
-sock[-1].bind(("172.16.5.16", 4001))
-
-data_str = []
-data_str.append("")
-data_str.append("")
-
-pkt = [None,] * CHANNELS
-for i in range(frames_to_capture):
-    for chan in range(CHANNELS):
-        pkt[chan], addr = sock[chan].recvfrom(8 + FRAME_SIZE)
-    for chan in range(CHANNELS):
-        data_str[chan] += pkt[chan][8:]
-
-for s in sock:
-    s.close()
-
-logger.info("Finished capturing {0} frames from {1} channel(s)".format(frames_to_capture, CHANNELS))
-
-dropped_pkts = 0
-for chan in range(CHANNELS):
-    last_sec_ref_ep = None
-    last_data_frame = None
-    for i in range(frames_to_capture):
-        pkt = data_str[chan][i*FRAME_SIZE:i*FRAME_SIZE+FRAME_SIZE]
-        frame = VDIFFrame.from_bin(pkt)
-
-        sec_ref_ep = frame.secs_since_epoch
-        data_frame = frame.data_frame
-        ref_epoch = frame.ref_epoch
-
-        frame_dt = datetime.datetime(year = 2000+(ref_epoch/2), month = (ref_epoch&1)*6, day = 1) + \
-            datetime.timedelta(seconds = sec_ref_ep)
-
-        if i == 0:
-            logger.info("Chan #{0} first frame time: {1} at frame #{2}".format(chan, frame_dt.isoformat(' '), data_frame))
-
-        if i == frames_to_capture - 1:
-            logger.info("Chan #{0} last frame time:  {1} at frame #{2}".format(chan, frame_dt.isoformat(' '), data_frame))
-
-        if i > 0:
-            if not data_frame == last_data_frame + 1:
-                if not sec_ref_ep == last_sec_ref_ep + 1:
-                    # print "Data frame incontinuity: {0} --> {1}".format(last_data_frame, data_frame)
-                    dropped_pkts += data_frame - last_data_frame
-    
-        last_sec_ref_ep = sec_ref_ep
-        last_data_frame = data_frame
-
-logger.info("Total dropped frames: {0}".format(dropped_pkts))
-logger.info("Lost frame rate: {0:5.2f}%".format(100. * dropped_pkts / (frames_to_capture*CHANNELS)))
-
-for chan in range(CHANNELS):
-    vdif_file = sys.argv[2] + "_chan{0}.vdif".format(chan)
-    with open(vdif_file, 'wb') as file_:
-        file_.write(data_str[chan])
+logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+logging.getLogger('capture').setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+addresses = args.addresses or list(parse_address(address) for address in DEFAULT_ADDRESSES)
+filenames = list(args.prefix + "_chan{0}.vdif".format(chan) for chan in range(len(addresses)))
+
+# capture, reporting rates every second
+capture = Capture(addresses, filenames, args.frames_to_capture, int(args.rcvbuf * 2**20), int(args.ring * 2**20),
+                  args.chunk, FRAME_SIZE, PSN_SIZE, args.batch)
+capture.start()
+try:
+    capture.monitor()
+except KeyboardInterrupt:
+    logger.info("Interrupted, stopping capture")
+    capture.stop()
+capture.join()
+
+# every packet short of the highest PSN seen went missing somewhere
+lost = captured = 0
+for chan, stats in enumerate(capture.stats()):
+    logger.info("Chan #{0} captured {1} frames, {2} lost, {3} reordered, {4} duplicates, {5} PSN restarts, "
+                "{6} overruns, {7} short packets, {8} kernel drops".format(
+                    chan, stats['packets'], stats['lost'], stats['reordered'], stats['duplicates'], stats['resyncs'],
+                    stats['overruns'], stats['short'], stats['kernel_drops']))
+    lost += stats['lost']
+    captured += stats['packets']
+
+for chan, filename in enumerate(filenames):
+    with VDIFFile(filename) as vdif_file:
+        if not len(vdif_file):
+            continue
+        logger.info("Chan #{0} first frame time: {1} at frame #{2}".format(
+            chan, vdif_file.header(0).datetime().isoformat(' '), vdif_file.header(0).data_frame))
+        logger.info("Chan #{0} last frame time:  {1} at frame #{2}".format(
+            chan, vdif_file.header(-1).datetime().isoformat(' '), vdif_file.header(-1).data_frame))
+
+logger.info("Total dropped frames: {0}".format(lost))
+logger.info("Lost frame rate: {0:5.2f}%".format(100. * lost / max(1, captured + lost)))
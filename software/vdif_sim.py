@@ -2,7 +2,10 @@ import logging, argparse
 from numpy import int32, around, sqrt
 from numpy.random import normal
 
-from vdif import VDIFFrame
+from vdif import VDIFFrameHeader, frames_to_bin
+
+# number of frames generated and packed at once
+FRAMES_PER_BLOCK = 256
 
 def gen_rand_data(length, bits, scale=1.):
     data = (2**bits) * normal(scale=scale, size=length)
@@ -26,18 +29,27 @@ if __name__ == "__main__":
     # Generate our correlated component
     corr_level = min(sqrt(args.corr_level), 1.0)
     uncorr_level = sqrt(1.0 - corr_level**2)
-    samples_per_frame = (32 / args.bits_per_sample) * (1024 * 2)
+    samples_per_frame = (32 // args.bits_per_sample) * (1024 * 2)
     corr_component = corr_level * gen_rand_data(samples_per_frame, args.bits_per_sample)
 
+    # reuse one output buffer for every block
+    frame_size = 1028 * 8
+    out_buf = bytearray(FRAMES_PER_BLOCK * frame_size)
+
     for station in range(args.total_stations):
         filename = "capt{0}.vdif".format(station)
         with open(filename, 'wb') as file_:
-            for frame_n in range(args.frames):
-                vdif_frame = VDIFFrame()
-                vdif_frame.station_id = station
-                vdif_frame.frame_length = 1028
-                vdif_frame.bits_per_sample = args.bits_per_sample
-                uncorr_component = uncorr_level * gen_rand_data(samples_per_frame, args.bits_per_sample)
-                vdif_frame.data = (corr_component + uncorr_component).astype(int32)
-                vdif_frame.data_frame = frame_n
-                file_.write(str(vdif_frame))
+            for block_start in range(0, args.frames, FRAMES_PER_BLOCK):
+                block_frames = min(FRAMES_PER_BLOCK, args.frames - block_start)
+                headers = []
+                for frame_n in range(block_start, block_start + block_frames):
+                    vdif_header = VDIFFrameHeader()
+                    vdif_header.station_id = station
+                    vdif_header.frame_length = 1028
+                    vdif_header.bits_per_sample = args.bits_per_sample
+                    vdif_header.data_frame = frame_n
+                    headers.append(vdif_header)
+                uncorr_component = uncorr_level * gen_rand_data((block_frames, samples_per_frame), args.bits_per_sample)
+                block_data = (corr_component + uncorr_component).astype(int32)
+                frames_to_bin(headers, block_data, out=out_buf)
+                file_.write(memoryview(out_buf)[:block_frames * frame_size])